@@ -30,6 +30,65 @@ void RunningStats::Push(double x)
     M2 += term1;
 }
  
+/* bulk push of size contiguous values, with the moments of the block
+   (two passes, so no division per value) merged into the accumulator */
+void RunningStats::Push(const double* x, long long size)
+{
+    if (size <= 0)
+        return;
+
+    RunningStats block;
+    double mean = 0.0, d, d2;
+    for (long long i = 0; i < size; i++)
+        mean += x[i];
+    mean /= size;
+
+    block.n = size;
+    block.M1 = mean;
+    for (long long i = 0; i < size; i++)
+    {
+        d = x[i] - mean;
+        d2 = d*d;
+        block.M2 += d2;
+        block.M3 += d2*d;
+        block.M4 += d2*d2;
+    }
+    Merge(block);
+}
+
+/* combine with the accumulator of other data (Chan et al.) */
+void RunningStats::Merge(const RunningStats& other)
+{
+    if (other.n == 0)
+        return;
+    if (n == 0)
+    {
+        *this = other;
+        return;
+    }
+    *this += other;
+}
+
+/* n, M1, M2, M3 and M4 into out[0] to out[4] */
+void RunningStats::Summary(double* out) const
+{
+    out[0] = double(n);
+    out[1] = M1;
+    out[2] = M2;
+    out[3] = M3;
+    out[4] = M4;
+}
+
+/* the state from a summary (see Summary) */
+void RunningStats::Load(const double* in)
+{
+    n = (long long)in[0];
+    M1 = in[1];
+    M2 = in[2];
+    M3 = in[3];
+    M4 = in[4];
+}
+
 long long RunningStats::NumDataValues() const
 {
     return n;
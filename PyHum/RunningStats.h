@@ -8,6 +8,10 @@ public:
     RunningStats();
     void Clear();
     void Push(double x);
+    void Push(const double* x, long long size);
+    void Merge(const RunningStats& other);
+    void Summary(double* out) const;
+    void Load(const double* in);
     long long NumDataValues() const;
     double Mean() const;
     double Variance() const;
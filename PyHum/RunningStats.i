@@ -6,4 +6,86 @@
 #include "RunningStats.h"
 %}
 
+/* contiguous float64 buffers (e.g. numpy arrays) are passed as raw bytes,
+   held for the duration of the call (released only if they were got).
+   Buffers of anything but native doubles are refused (TypeError), as are
+   summary and state buffers of fewer than 5 doubles (ValueError) */
+%{
+static int is_double_buffer(Py_buffer *view) {
+    const int one = 1;
+    const char native = *(const char *)&one ? '<' : '>';
+    const char *f = view->format;
+    if (f == NULL || view->itemsize != sizeof(double))
+        return 0;
+    if (f[0] == '@' || f[0] == '=' || f[0] == native)
+        f++;
+    return f[0] == 'd' && f[1] == '\0';
+}
+%}
+
+%typemap(in) (const char *data, size_t nbytes) (Py_buffer view) {
+    if (PyObject_GetBuffer($input, &view, PyBUF_CONTIG_RO | PyBUF_FORMAT) < 0) {
+        SWIG_exception_fail(SWIG_TypeError, "in method '$symname', expected a contiguous buffer");
+    }
+    $1 = (char *) view.buf;
+    $2 = (size_t) view.len;
+    if (!is_double_buffer(&view)) {
+        SWIG_exception_fail(SWIG_TypeError, "in method '$symname', expected a buffer of float64");
+    }
+}
+%typemap(freearg) (const char *data, size_t nbytes) {
+    if ($1) PyBuffer_Release(&view$argnum);
+}
+%typemap(in) (const char *state, size_t nbytes) (Py_buffer view) {
+    if (PyObject_GetBuffer($input, &view, PyBUF_CONTIG_RO | PyBUF_FORMAT) < 0) {
+        SWIG_exception_fail(SWIG_TypeError, "in method '$symname', expected a contiguous buffer");
+    }
+    $1 = (char *) view.buf;
+    $2 = (size_t) view.len;
+    if (!is_double_buffer(&view)) {
+        SWIG_exception_fail(SWIG_TypeError, "in method '$symname', expected a buffer of float64");
+    }
+    if ($2 < 5*sizeof(double)) {
+        SWIG_exception_fail(SWIG_ValueError, "in method '$symname', expected a buffer of 5 float64");
+    }
+}
+%typemap(freearg) (const char *state, size_t nbytes) {
+    if ($1) PyBuffer_Release(&view$argnum);
+}
+%typemap(in) (char *summary, size_t nbytes) (Py_buffer view) {
+    if (PyObject_GetBuffer($input, &view, PyBUF_CONTIG | PyBUF_FORMAT) < 0) {
+        SWIG_exception_fail(SWIG_TypeError, "in method '$symname', expected a writable contiguous buffer");
+    }
+    $1 = (char *) view.buf;
+    $2 = (size_t) view.len;
+    if (!is_double_buffer(&view)) {
+        SWIG_exception_fail(SWIG_TypeError, "in method '$symname', expected a buffer of float64");
+    }
+    if ($2 < 5*sizeof(double)) {
+        SWIG_exception_fail(SWIG_ValueError, "in method '$symname', expected a buffer of 5 float64");
+    }
+}
+%typemap(freearg) (char *summary, size_t nbytes) {
+    if ($1) PyBuffer_Release(&view$argnum);
+}
+
+%ignore RunningStats::Push(const double*, long long);
+%ignore RunningStats::Summary;
+%ignore RunningStats::Load;
+
 %include "RunningStats.h"
+
+%extend RunningStats {
+    /* push every value of a buffer of doubles */
+    void PushBuffer(const char *data, size_t nbytes) {
+        $self->Push((const double*)data, (long long)(nbytes/sizeof(double)));
+    }
+    /* n, M1, M2, M3 and M4 into a writable buffer of 5 doubles */
+    void SummaryBuffer(char *summary, size_t nbytes) {
+        $self->Summary((double*)summary);
+    }
+    /* the state from a buffer of 5 doubles made by SummaryBuffer */
+    void LoadBuffer(const char *state, size_t nbytes) {
+        $self->Load((const double*)state);
+    }
+}
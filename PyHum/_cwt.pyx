@@ -27,6 +27,15 @@ import numpy as np
 cimport numpy as np
 cimport cython
 from libc.math cimport sqrt,log,abs
+from collections import OrderedDict
+from threading import Lock
+
+# Morlet filter banks, keyed by (win, largestscale, notes), see filterbank.
+# The cache is shared by the threads of a process, so is only read and 
+# changed holding _bankslock
+_banks = OrderedDict()
+_maxbanks = 8
+_bankslock = Lock()
 
 # =========================================================
 cdef class Cwt:
@@ -74,8 +83,6 @@ cdef class Cwt:
         cdef int lr = len(self.r)
         cdef int i, scaleindex
         
-        cdef np.ndarray[np.float64_t, ndim=0] currentscale 
-        
         cdef double base2 
         base2 = np.floor(log(self.win)/log(2) + 0.4999)
                    
@@ -86,14 +93,12 @@ cdef class Cwt:
         self._setscales(ndata,largestscale,notes)
         cdef np.ndarray[np.complex64_t, ndim=3] cwt = np.zeros((self.nscale,ndata,len(self.r)),dtype=np.complex64)
         self.cwt = cwt
-        cdef np.ndarray[np.float64_t, ndim=1] omega = np.empty(ndata, dtype=np.float64)
-        omega = np.array(range(0,np.int(ndata/2))+range(-np.int(ndata/2),0))*(2.0*pi/ndata)
+        cdef np.ndarray bank
+        bank = filterbank(self.win, largestscale, notes)[1]
         
         cdef np.ndarray[np.float32_t,ndim=1] data = np.empty(self.win, dtype=np.float32)
         cdef np.ndarray[np.float64_t,ndim=1] data2 = np.empty(ndata, dtype=np.float64)
         cdef np.ndarray[np.complex128_t,ndim=1] datahat = np.empty(ndata, dtype=np.complex128)
-        cdef np.ndarray[np.float64_t,ndim=1] s_omega = np.empty(ndata, dtype=np.float64)
-        cdef np.ndarray[np.float64_t,ndim=1] psihat = np.empty(ndata, dtype=np.float64)
 
         for i from 0 <= i < lr:  
            data = np.asarray( self._column(matrix, np.int(self.r[i]) ) )
@@ -103,11 +108,8 @@ cdef class Cwt:
            self.fftdata = datahat
       
            for scaleindex from 0 <= scaleindex < self.nscale:
-              currentscale = np.asarray(self.scales[scaleindex])
-              self.currentscale = currentscale  # for internal use
-              s_omega = omega*currentscale
-              psihat = self._wf(s_omega) * sqrt(2.0*pi*currentscale)
-              self.cwt[scaleindex,0:ndata,i] = np.fft.ifft(psihat * datahat)        
+              self.currentscale = np.asarray(self.scales[scaleindex])  # for internal use
+              self.cwt[scaleindex,0:ndata,i] = np.fft.ifft(bank[scaleindex] * datahat)        
         return
 
     # =========================================================
@@ -212,3 +214,192 @@ cdef class Cwt:
         return np.sum(dat*self.scales)
         
         
+# =========================================================
+@cython.boundscheck(False)
+@cython.cdivision(True)
+@cython.wraparound(False)
+@cython.nonecheck(False)
+def cwt_var(np.ndarray windows, int largestscale, int notes, int win, int density):
+    """
+    batched continuous Morlet wavelet transform of a stack of windows
+
+    windows: (nwindows, win, win) array
+    returns, for every window, the same lengthscale as
+    Cwt(windows[k], largestscale, notes, win, density).getvar()
+    """
+    cdef np.ndarray r = np.arange(1,win-1,density, dtype=np.int)
+
+    # sampled columns of every window, (nw, ncols, win)
+    data = np.asarray(windows[:,:win,:][:,:,r], np.float64).transpose(0,2,1)
+    return _colvar(data, largestscale, notes, win)
+
+# =========================================================
+@cython.boundscheck(False)
+@cython.cdivision(True)
+@cython.wraparound(False)
+@cython.nonecheck(False)
+def cwt_var2(np.ndarray windows, int largestscale, int notes, int win, int density):
+    """
+    as cwt_var, for both orientations of every window at once
+
+    windows: (nwindows, win, win) array
+    returns a (2, nwindows) array, the lengthscales of windows[k] in
+    row 0 and of windows[k].T in row 1. The sampled columns and rows of
+    all windows share one padded fft, filter bank and set of ifft's
+    """
+    cdef np.ndarray r = np.arange(1,win-1,density, dtype=np.int)
+    cdef int nw = windows.shape[0]
+
+    # sampled columns (as in windows[k]) then sampled rows (the columns 
+    # of windows[k].T) of every window, (2*nw, ncols, win)
+    data = np.empty((2*nw, len(r), win), np.float64)
+    data[:nw] = windows[:,:win,:][:,:,r].transpose(0,2,1)
+    data[nw:] = windows[:,:,:win][:,r,:]
+    return _colvar(data, largestscale, notes, win).reshape((2, nw))
+
+# =========================================================
+@cython.boundscheck(False)
+@cython.cdivision(True)
+@cython.wraparound(False)
+@cython.nonecheck(False)
+cdef np.ndarray _colvar(np.ndarray data, int largestscale, int notes, int win):
+    """
+    lengthscale (as Cwt.getvar) of each set of columns in data, an 
+    (n, ncols, win) array of time series.
+
+    one column (of every set) at a time is demeaned and transformed with
+    one fft. Then, one scale at a time, it is multiplied with the (cached)
+    wavelet filter of that scale and inverted with one ifft, and the 
+    variance over time of the power at that scale is added straight away
+    to a running variance over the columns. So only (n, ndata) 
+    coefficients are ever held, and (n, nscale) running statistics
+    """
+    cdef float pi = 3.14159265
+
+    scales, bank = filterbank(win, largestscale, notes)
+    cdef int nscale = len(scales)
+    cdef int ndata = bank.shape[1]
+    cdef int nw = data.shape[0]
+    cdef int ncol = data.shape[1]
+    cdef int j, k
+
+    # windows too small for any scale have no lengthscale
+    if nscale == 0:
+       return np.zeros(nw, np.float64)
+
+    # the cached bank is read-only, which this Cython's typed memoryviews
+    # do not take, so its rows are read through a pointer instead
+    cdef double *bankp = <double *> np.PyArray_DATA(bank)
+
+    # running mean and sum of squared deviations (over columns) of the 
+    # variance (over time) of the power at each scale
+    cdef np.ndarray[np.float64_t, ndim=2] mean = np.zeros((nw, nscale), np.float64)
+    cdef np.ndarray[np.float64_t, ndim=2] M2 = np.zeros((nw, nscale), np.float64)
+    cdef double[:, ::1] meanv = mean
+    cdef double[:, ::1] M2v = M2
+    cdef double complex[:, ::1] filtered = np.empty((nw, ndata), np.complex128)
+    cdef double complex[:, ::1] datahat
+    cdef double complex[:, ::1] c
+    cdef double scale
+    for k from 0 <= k < ncol:
+       col = data[:,k,:]
+       datahat = np.ascontiguousarray(np.fft.fft(col - col.mean(axis=1)[:,None], n=ndata, axis=1), np.complex128)
+       for j from 0 <= j < nscale:
+          scale = scales[j]
+          with nogil:
+             _filter(datahat, bankp + j*ndata, filtered)
+          c = np.ascontiguousarray(np.fft.ifft(filtered, axis=1), np.complex128)
+          with nogil:
+             _powervar(c, win, scale, k, meanv[:,j], M2v[:,j])
+    del datahat, filtered, c, mean
+
+    dat = M2/ncol
+    n = np.r_[0:nscale]-(nscale-1)/2
+    dat = dat/np.sum(dat, axis=1)[:,None] * np.exp(-(0.5)*((pi/2)*n/((nscale-1)/2))**2)
+    dat = dat/np.sum(dat, axis=1)[:,None]
+    return np.sum(dat*scales, axis=1)
+
+# =========================================================
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _filter(double complex[:, ::1] datahat, double *filt, double complex[:, ::1] out) nogil:
+    """
+    out = datahat*filt, the filter applied to every time series
+    """
+    cdef Py_ssize_t i, t
+    for i in range(datahat.shape[0]):
+       for t in range(datahat.shape[1]):
+          out[i,t] = datahat[i,t]*filt[t]
+
+# =========================================================
+@cython.boundscheck(False)
+@cython.cdivision(True)
+@cython.wraparound(False)
+cdef void _powervar(double complex[:, ::1] c, int win, double scale, int k, double[:] mean, double[:] M2) nogil:
+    """
+    for each time series i of wavelet coefficients c (column k of set i),
+    the variance over time (the first win samples, two-pass, as np.var)
+    of the power |c|**2/scale, added to the running mean[i] and sum of 
+    squared deviations M2[i] of the variances of the columns (Welford)
+    """
+    cdef Py_ssize_t i, t
+    cdef double p, m, v
+    for i in range(c.shape[0]):
+       m = 0
+       for t in range(win):
+          m += (c[i,t].real*c[i,t].real + c[i,t].imag*c[i,t].imag)/scale
+       m /= win
+       v = 0
+       for t in range(win):
+          p = (c[i,t].real*c[i,t].real + c[i,t].imag*c[i,t].imag)/scale - m
+          v += p*p
+       v /= win
+       p = v - mean[i]
+       mean[i] += p/(k+1)
+       M2[i] += p*(v - mean[i])
+
+# =========================================================
+@cython.boundscheck(False)
+@cython.cdivision(True)
+@cython.wraparound(False)
+@cython.nonecheck(False)
+def filterbank(int win, int largestscale, int notes):
+    """
+    scales (nscale,) and Morlet wavelet filters (nscale, ndata), 
+    normalised by sqrt(2 pi scale), for windows of length win.
+
+    They depend only on win, largestscale and notes, so are built once
+    per parameter set (in each process) and kept, read-only, in a cache
+    of the _maxbanks most recently used sets. The bank is built outside 
+    the lock, so two threads may both build a new one; the last is kept
+    """
+    key = (win, largestscale, notes)
+    with _bankslock:
+       try:
+          bank = _banks.pop(key)
+          _banks[key] = bank
+          return bank
+       except KeyError:
+          pass
+
+    cdef float pi = 3.14159265
+    cdef int j
+    cdef double base2 = np.floor(log(win)/log(2) + 0.4999)
+    cdef int ndata = int(2**(base2+1))
+    cdef int nscale = notes*int(log(ndata/largestscale/2+0.0001)/log(2.0)+0.0001)
+
+    cdef np.ndarray[np.float64_t, ndim=1] scales = np.empty(nscale, np.float64)
+    for j from 0 <= j < nscale:
+       scales[j] = ndata/(largestscale*(2.0**(nscale-1-j)/notes))
+
+    omega = np.array(range(0,np.int(ndata/2))+range(-np.int(ndata/2),0))*(2.0*pi/ndata)
+    bank = 0.75112554*np.exp(-(scales[:,None]*omega[None,:]-6.0)**2/2.0)*np.sqrt(2.0*pi*scales)[:,None]
+
+    scales.flags.writeable = False
+    bank.flags.writeable = False
+    with _bankslock:
+       if key not in _banks and len(_banks) >= _maxbanks:
+          _banks.popitem(last=False)
+       _banks[key] = (scales, bank)
+    return scales, bank
+
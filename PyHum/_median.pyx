@@ -0,0 +1,152 @@
+# cython module for running median filters
+# Daniel Buscombe, June-Aug 2014
+"""
+Part of PyHum software
+
+INFO:
+
+
+Author:    Daniel Buscombe
+           Grand Canyon Monitoring and Research Center
+           United States Geological Survey
+           Flagstaff, AZ 86001
+           dbuscombe@usgs.gov
+Version: 1.2.3      Revision: Apr, 2015
+
+For latest code version please visit:
+https://github.com/dbuscombe-usgs
+
+This function is part of 'PyHum' software
+This software is in the public domain because it contains materials that originally came from the United States Geological Survey, an agency of the United States Department of Interior.
+For more information, see the official USGS copyright policy at
+http://www.usgs.gov/visual-id/credit_usgs.html#copyright
+"""
+
+from __future__ import division
+import numpy as np
+cimport numpy as np
+cimport cython
+from libc.math cimport NAN
+
+# =========================================================
+def median_filter(np.ndarray array, size, int nbins=256):
+    """
+    Running median of a 2d array, in constant time per element whatever
+    the size of the window (Perreault and Hebert, 2007): one histogram per
+    column of the window is kept as the window moves down the array, and
+    the histogram of the window is updated, as it moves along a row, by
+    adding the column histogram that comes in and removing the one that
+    goes out
+
+    Parameters
+    ----------
+    array : 2d np.ndarray
+    the array to filter. NaN elements are ignored
+    size : int or (int, int)
+    the window size along each axis. The window and edges (reflected)
+    are as in scipy.ndimage.median_filter
+    nbins : int, *optional* [Default=256]
+    the values are binned into nbins levels between their min and max, so
+    the result is within (max-min)/nbins of the exact median
+
+    Returns
+    -------
+    filtered : 2d np.ndarray
+    a float64 array, the median of the valid elements of each window
+    (NaN if there are none)
+    """
+    cdef np.ndarray[np.float64_t, ndim=2] a = np.array(array, dtype=np.float64, order='C')
+    cdef np.ndarray[np.float64_t, ndim=2] out = np.empty_like(a)
+    size = np.asarray(size, int)*np.ones(2, int)
+    cdef int k0 = max(size[0], 1), k1 = max(size[1], 1)
+    cdef double lo, width
+
+    finite = np.isfinite(a)
+    if not finite.any():
+       out[:] = np.nan
+       return out
+    lo = a[finite].min()
+    width = (a[finite].max()-lo)/nbins
+    if width == 0:
+       # constant: one bin, centred on the value
+       width = 1.0
+       lo = lo-0.5
+
+    # bin number of each element, -1 for NaNs
+    q = np.floor((a-lo)/width)
+    q[q>nbins-1] = nbins-1
+    q[~finite] = -1
+    q = np.pad(q.astype(np.int32), ((k0//2, k0-1-k0//2), (k1//2, k1-1-k1//2)), mode='symmetric')
+
+    _hmedian(np.ascontiguousarray(q), k0, k1, nbins, lo, width, out)
+    return out
+
+# =========================================================
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void _hmedian(int[:, ::1] q, int k0, int k1, int nbins, double lo, double width, double[:, ::1] out):
+    """
+    the histogram running median of bin numbers q (padded by the window
+    size less one on each axis), into out, as values at the bin centres
+    """
+    cdef Py_ssize_t nr = out.shape[0], nc = out.shape[1], npc = q.shape[1]
+    cdef Py_ssize_t i, j, b
+    cdef int v, d, m, n, below
+    cdef int[:, ::1] H = np.zeros((npc, nbins), dtype=np.int32)
+    cdef int[::1] cnt = np.zeros(npc, dtype=np.int32)
+    cdef int[::1] kern = np.zeros(nbins, dtype=np.int32)
+
+    with nogil:
+       for i in range(k0-1):
+          for j in range(npc):
+             v = q[i,j]
+             if v >= 0:
+                H[j,v] = H[j,v] + 1
+                cnt[j] = cnt[j] + 1
+
+       for i in range(nr):
+          # column histograms move down one row
+          for j in range(npc):
+             if i > 0:
+                v = q[i-1,j]
+                if v >= 0:
+                   H[j,v] = H[j,v] - 1
+                   cnt[j] = cnt[j] - 1
+             v = q[i+k0-1,j]
+             if v >= 0:
+                H[j,v] = H[j,v] + 1
+                cnt[j] = cnt[j] + 1
+
+          for b in range(nbins):
+             kern[b] = 0
+          n = 0
+          for j in range(k1):
+             for b in range(nbins):
+                kern[b] = kern[b] + H[j,b]
+             n = n + cnt[j]
+          m = 0
+          below = 0
+
+          for j in range(nc):
+             if j > 0:
+                # the window moves along one column. below counts the
+                # elements in bins under m, the last median bin
+                for b in range(m):
+                   d = H[j+k1-1,b] - H[j-1,b]
+                   kern[b] = kern[b] + d
+                   below = below + d
+                for b in range(m, nbins):
+                   kern[b] = kern[b] + H[j+k1-1,b] - H[j-1,b]
+                n = n + cnt[j+k1-1] - cnt[j-1]
+             if n == 0:
+                out[i,j] = NAN
+                continue
+             # the element of rank n//2, as scipy.ndimage.median_filter
+             while below > n//2:
+                m = m - 1
+                below = below - kern[m]
+             while below + kern[m] <= n//2:
+                below = below + kern[m]
+                m = m + 1
+             out[i,j] = lo + (m+0.5)*width
@@ -63,12 +63,12 @@ try:
    from tkFileDialog import askopenfilename, askdirectory
 except:
    pass
-#from joblib import Parallel, delayed, cpu_count
+from joblib import Parallel, delayed, cpu_count
 
 #numerical
 import numpy as np
 #from pyhum_utils import rm_spikes, sliding_window, runningMeanFast, dpboundary, rescale
-#import PyHum.utils as humutils
+import PyHum.utils as humutils
 #from scipy.stats import nanmean, nanmedian
 import ppdrc
 
@@ -91,12 +91,12 @@ np.seterr(invalid='ignore')
 __all__ = [
     'correct',
     'custom_save',
-    'remove_water',
-    'correct_scans',
+    'correct_unit',
+    'correct_chunk',
     ]
 
 #################################################
-def correct(humfile, sonpath, maxW, doplot):
+def correct(humfile, sonpath, maxW, doplot, numproc=0, dofilt=0):
 
     '''
     Remove water column and carry out some rudimentary radiometric corrections, 
@@ -104,7 +104,7 @@ def correct(humfile, sonpath, maxW, doplot):
 
     Syntax
     ----------
-    [] = PyHum.correct(humfile, sonpath, maxW, doplot)
+    [] = PyHum.correct(humfile, sonpath, maxW, doplot, numproc, dofilt)
 
     Parameters
     ----------
@@ -116,6 +116,14 @@ def correct(humfile, sonpath, maxW, doplot):
        maximum transducer power
     doplot : int, *optional* [Default=1]
        1 = make plots, otherwise do not
+    numproc : int, *optional* [Default=number of processors]
+       number of worker processes. Each chunk of each scan is
+       processed independently
+    dofilt : int, *optional* [Default=0]
+       1 = apply a phase preserving dynamic range compression filter
+       to the radiometrically corrected scans, otherwise do not.
+       The filtered scans are rescaled to 0-255 by the global min and
+       max of each scan
 
     Returns
     -------
@@ -133,10 +141,6 @@ def correct(humfile, sonpath, maxW, doplot):
         contains the portside scan with water column removed and
         radiometrically corrected
 
-    sonpath+base+'_data_range.dat': memory-mapped file
-        contains the cosine of the range which is used to correct
-        for attenuation with range
-
     sonpath+base+'_data_dwnlow_l.dat': memory-mapped file
         contains the low freq. downward scan with water column removed
 
@@ -150,6 +154,11 @@ def correct(humfile, sonpath, maxW, doplot):
     sonpath+base+'_data_dwnhi_la.dat': memory-mapped file
         contains the high freq. downward  scan with water column removed and
         radiometrically corrected
+
+    sonpath+base+'meta.mat': file
+        updated with statistics (count, min, max, mean, M2, histogram) of
+        each scan, accumulated over all chunks, under keys such as 
+        'star_l_*' and 'star_la_*' (see humutils.EchoStats)
     '''
 
     # prompt user to supply file if no input file given
@@ -181,11 +190,26 @@ def correct(humfile, sonpath, maxW, doplot):
       maxW = 1000
       print '[Default] Max. transducr power is %s W' % (str(maxW))
 
+    if numproc:
+      numproc = int(numproc)
+      print 'Number of processors is %s' % (str(numproc))
+    if dofilt:
+      dofilt = int(dofilt)
+      if dofilt==1:
+         print "Phase preserving filter will be applied"
+
     if not doplot:
       if doplot != 0:
          doplot = 1
          print "[Default] Plots will be made"
 
+    if not numproc:
+      numproc = cpu_count()
+      print '[Default] Number of processors is %s' % (str(numproc))
+
+    if not dofilt:
+      dofilt = 0
+      print "[Default] No phase preserving filter will be applied"
 
     # start timer
     if os.name=='posix': # true if linux/mac or cygwin on windows
@@ -227,85 +251,8 @@ def correct(humfile, sonpath, maxW, doplot):
 
     bed = np.asarray(bed,'int')+int(0.25*ft)
 
-    # calculate in dB
-    ######### star
-    Zt, R = remove_water(star_fp, bed, shape_star, dep_m, pix_m, 1,  maxW)
-
-    # create memory mapped file for Z
-    fp = np.memmap(sonpath+base+'_data_star_l.dat', dtype='float32', mode='w+', shape=np.shape(Zt))
-    fp[:] = Zt[:]
-    del fp
-    shape_star = np.shape(Zt)
-    del Zt
-
-    # create memory mapped file for R
-    fp = np.memmap(sonpath+base+'_data_range.dat', dtype='float32', mode='w+', shape=np.shape(R))
-    fp[:] = R[:]
-    del fp
-    del R
-
-    #we are only going to access the portion of memory required
-    star_fp = np.memmap(sonpath+base+'_data_star_l.dat', dtype='float32', mode='r', shape=shape_star)
-    R_fp = np.memmap(sonpath+base+'_data_range.dat', dtype='float32', mode='r', shape=shape_star)
-
-    Zt = correct_scans(star_fp, R_fp)
-    #for p in xrange(len(Zt)):
-
-    #   dat1 = Zt[p].astype('float64')
-    #   dat1[np.isnan(dat1)] = 0
-    #   dat1 = ppdrc.ppdrc(dat1, shape_star[-1]/10)
-    #   dat1 = rescale(dat1.getdata(),0,255)
-    #   dat1[np.isnan(Zt[p])] = np.nan
-    #   Zt[p] = dat1.astype('float32')
-    #   del dat1
-
-    # create memory mapped file for Z
-    fp = np.memmap(sonpath+base+'_data_star_la.dat', dtype='float32', mode='w+', shape=np.shape(Zt))
-    fp[:] = Zt[:]
-    del fp
-    shape_star = np.shape(Zt)
-    del Zt
-    #we are only going to access the portion of memory required
-    star_fp = np.memmap(sonpath+base+'_data_star_la.dat', dtype='float32', mode='r', shape=shape_star)
-
-
-    ######### port
-    Zt = remove_water(port_fp, bed, shape_port, dep_m, pix_m, 0,  maxW)
-
-    # create memory mapped file for Z
-    fp = np.memmap(sonpath+base+'_data_port_l.dat', dtype='float32', mode='w+', shape=np.shape(Zt))
-    fp[:] = Zt[:]
-    del fp
-    shape_port = np.shape(Zt)
-    del Zt
-    #we are only going to access the portion of memory required
-    port_fp = np.memmap(sonpath+base+'_data_port_l.dat', dtype='float32', mode='r', shape=shape_port)
-
-    Zt = correct_scans(port_fp, R_fp)
-    #for p in xrange(len(Zt)):
-
-    #   dat1 = Zt[p].astype('float64')
-    #   dat1[np.isnan(dat1)] = 0
-    #   dat1 = ppdrc.ppdrc(dat1, shape_port[-1]/4)
-    #   dat1 = rescale(dat1.getdata(),0,255)
-    #   dat1[np.isnan(Zt[p])] = np.nan
-    #   Zt[p] = dat1.astype('float32')
-    #   del dat1
-
-    # create memory mapped file for Z
-    fp = np.memmap(sonpath+base+'_data_port_la.dat', dtype='float32', mode='w+', shape=np.shape(Zt))
-    fp[:] = Zt[:]
-    del fp
-    shape_port = np.shape(Zt)
-    del Zt
-    #we are only going to access the portion of memory required
-    port_fp = np.memmap(sonpath+base+'_data_port_la.dat', dtype='float32', mode='r', shape=shape_port)
-
-
-    ## do plots of merged scans
-    if doplot==1:
-      for p in xrange(len(star_fp)):
-         plot_merged_scans(port_fp[p], star_fp[p], dist_m, shape_port, ft, sonpath, p)
+    # range geometry is computed on the fly from dep_m, pix_m and bed
+    R_fp = humutils.RangeGeometry(dep_m, pix_m, bed, shape_star)
 
     # load memory mapped scans
     shape_low = np.squeeze(loadmat(sonpath+base+'meta.mat')['shape_low'])
@@ -324,78 +271,73 @@ def correct(humfile, sonpath, maxW, doplot):
           if 'shape_low' in locals():
              hi_fp = np.memmap(sonpath+base+'_data_dwnhi.dat', dtype='int16', mode='r', shape=tuple(shape_low))
 
+    # scans to correct. Only the sidescans are corrected for range
+    channels = [(star_fp, R_fp, sonpath+base+'_data_star'), (port_fp, R_fp, sonpath+base+'_data_port')]
+    if 'low_fp' in locals():
+       channels.append((low_fp, None, sonpath+base+'_data_dwnlow'))
+    if 'hi_fp' in locals():
+       channels.append((hi_fp, None, sonpath+base+'_data_dwnhi'))
+
+    # every (scan, chunk) is an independent unit of work. Output files are
+    # allocated up front and each unit writes its own chunk into them
+    units = []
+    for dat_fp, r_fp, root in channels:
+       shape = np.shape(dat_fp)
+       for ext in ['_l.dat', '_la.dat']:
+          fp = np.memmap(root+ext, dtype='float32', mode='w+', shape=shape)
+          del fp
+       for p in xrange(len(dat_fp)):
+          units.append((dat_fp.filename, shape, p, bed[shape[-1]*p:shape[-1]*(p+1)], r_fp, maxW, root, dofilt))
+
+    print "%s chunks to process" % (str(len(units)))
+    # water column removal, dB scaling and range correction are fused
+    # into one streaming pass per chunk, see correct_chunk
+    stats = Parallel(n_jobs = numproc, verbose=0)(delayed(correct_unit)(*u) for u in units)
+
+    # merge the statistics of each chunk into global statistics per scan
+    meta = loadmat(sonpath+base+'meta.mat')
+    gstats = merge_stats(units, stats)
+
+    if dofilt==1:
+       # the filtered scans are rescaled to 0-255 in a second pass, every
+       # chunk by the global min and max of its scan so there are no jumps
+       # in brightness between chunks
+       stats = Parallel(n_jobs = numproc, verbose=0)(delayed(rescale_unit)(u[6], u[1], u[2], len(u[3]), gstats[u[6].split('_data_')[-1]][1]) for u in units)
+       for name, s in merge_stats(units, [(None, la_stats) for la_stats in stats]).items():
+          gstats[name][1] = s[1]
+
+    for name in gstats:
+       meta.update(gstats[name][0].todict(name+'_l'))
+       meta.update(gstats[name][1].todict(name+'_la'))
+    savemat(sonpath+base+'meta.mat', meta ,oned_as='row')
+    del meta, stats
+
+    #we are only going to access the portion of memory required
+    star_fp = np.memmap(sonpath+base+'_data_star_la.dat', dtype='float32', mode='r', shape=np.shape(star_fp))
+    port_fp = np.memmap(sonpath+base+'_data_port_la.dat', dtype='float32', mode='r', shape=np.shape(port_fp))
+    shape_port = np.shape(port_fp)
+
+    ## do plots of merged scans, all on the same grey scale
+    if doplot==1:
+      clim = (min(gstats['port'][1].min, gstats['star'][1].min), max(gstats['port'][1].max, gstats['star'][1].max))
+      for p in xrange(len(star_fp)):
+         plot_merged_scans(port_fp[p], star_fp[p], dist_m, shape_port, ft, sonpath, p, clim)
 
     if 'low_fp' in locals():
-       ######### low
-       Zt = remove_water(low_fp, bed, shape_low, dep_m, pix_m, 0,  maxW)
-
-       # create memory mapped file for Z
-       fp = np.memmap(sonpath+base+'_data_dwnlow_l.dat', dtype='float32', mode='w+', shape=np.shape(Zt))
-       fp[:] = Zt[:]
-       del fp
-       shape_low = np.shape(Zt)
-       del Zt
-       #we are only going to access the portion of memory required
-       low_fp = np.memmap(sonpath+base+'_data_dwnlow_l.dat', dtype='float32', mode='r', shape=shape_low)
-
-       Zt = correct_scans2(low_fp)
-       #for p in xrange(len(Zt)):
-       #   dat1 = Zt[p].astype('float64')
-       #   dat1[np.isnan(dat1)] = 0
-       #   dat1 = ppdrc.ppdrc(dat1, shape_low[-1]/4)
-       #   dat1 = rescale(dat1.getdata(),0,255)
-       #   dat1[np.isnan(Zt[p])] = np.nan
-       #   Zt[p] = dat1.astype('float32')
-       #   del dat1
-
-       # create memory mapped file for Z
-       fp = np.memmap(sonpath+base+'_data_dwnlow_la.dat', dtype='float32', mode='w+', shape=np.shape(Zt))
-       fp[:] = Zt[:]
-       del fp
-       shape_low = np.shape(Zt)
-       del Zt
-       #we are only going to access the lowion of memory required
+       shape_low = np.shape(low_fp)
        low_fp = np.memmap(sonpath+base+'_data_dwnlow_la.dat', dtype='float32', mode='r', shape=shape_low)
 
        if doplot==1:
           for p in xrange(len(low_fp)):
-             plot_dwnlow_scans(low_fp[p], dist_m, shape_low, ft, sonpath, p)
+             plot_dwnlow_scans(low_fp[p], dist_m, shape_low, ft, sonpath, p, (gstats['dwnlow'][1].min, gstats['dwnlow'][1].max))
 
     if 'hi_fp' in locals():
-       ######### hi
-       Zt = remove_water(hi_fp, bed, shape_hi, dep_m, pix_m, 0,  maxW)
-
-       # create memory mapped file for Z
-       fp = np.memmap(sonpath+base+'_data_dwnhi_l.dat', dtype='float32', mode='w+', shape=np.shape(Zt))
-       fp[:] = Zt[:]
-       del fp
-       shape_hi = np.shape(Zt)
-       del Zt
-       #we are only going to access the portion of memory required
-       hi_fp = np.memmap(sonpath+base+'_data_dwnhi_l.dat', dtype='float32', mode='r', shape=shape_hi)
-
-       Zt = correct_scans2(hi_fp)
-       #for p in xrange(len(Zt)):
-       #   dat1 = Zt[p].astype('float64')
-       #   dat1[np.isnan(dat1)] = 0
-       #   dat1 = ppdrc.ppdrc(dat1, shape_hi[-1]/4)
-       #   dat1 = rescale(dat1.getdata(),0,255)
-       #   dat1[np.isnan(Zt[p])] = np.nan
-       #   Zt[p] = dat1.astype('float32')
-       #   del dat1
-
-       # create memory mapped file for Z
-       fp = np.memmap(sonpath+base+'_data_dwnhi_la.dat', dtype='float32', mode='w+', shape=np.shape(Zt))
-       fp[:] = Zt[:]
-       del fp
-       shape_hi = np.shape(Zt)
-       del Zt
-       #we are only going to access the hiion of memory required
+       shape_hi = np.shape(hi_fp)
        hi_fp = np.memmap(sonpath+base+'_data_dwnhi_la.dat', dtype='float32', mode='r', shape=shape_hi)
 
        if doplot==1:
           for p in xrange(len(hi_fp)):
-             plot_dwnhi_scans(hi_fp[p], dist_m, shape_hi, ft, sonpath, p)
+             plot_dwnhi_scans(hi_fp[p], dist_m, shape_hi, ft, sonpath, p, (gstats['dwnhi'][1].min, gstats['dwnhi'][1].max))
 
     if os.name=='posix': # true if linux/mac
        elapsed = (time.time() - start)
@@ -411,83 +353,137 @@ def custom_save(figdirec,root):
     plt.savefig(figdirec+root,bbox_inches='tight',dpi=400)
 
 # =========================================================
-def remove_water(fp,bed,shape, dep_m, pix_m, calcR,  maxW):
-    Zt = []
-    if calcR==1:
-       R = []
-
-    for p in xrange(len(fp)):
-       data_dB = fp[p]*(10*np.log10(maxW)/255)
-
-       Zbed = np.squeeze(bed[shape[-1]*p:shape[-1]*(p+1)])
-
-       # shift proportionally depending on where the bed is
-       for k in xrange(np.shape(data_dB)[1]):
-          try:
-             data_dB[:,k] = np.r_[data_dB[Zbed[k]:,k], np.zeros( (np.shape(data_dB)[0] -  np.shape(data_dB[Zbed[k]:,k])[0] ,) )]
-          except:
-             data_dB[:,k] = np.ones(np.shape(data_dB)[0])
-
-       Zt.append(data_dB)    
-
-
-       if calcR ==1:
-          extent = shape[1]
-          yvec = np.linspace(pix_m,extent*pix_m,extent)
-          d = dep_m[shape[-1]*p:shape[-1]*(p+1)]
-
-          r = np.ones(np.shape(fp[p]))
-          for k in range(len(d)): 
-             r[:,k] = d[k]/yvec
-
-          # shift proportionally depending on where the bed is
-          for k in xrange(np.shape(r)[1]):
-             try:
-                r[:,k] = np.r_[r[Zbed[k]:,k], np.zeros( (np.shape(r)[0] -  np.shape(r[Zbed[k]:,k])[0] ,) )]
-             except:
-                r[:,k] = np.ones(np.shape(r)[0])
-
-          R.append(r)
+def merge_stats(units, stats):
+    '''
+    merge the (_l, _la) statistics returned for each unit of work into
+    global statistics per scan, a dictionary of [l_stats, la_stats] 
+    keyed by scan name (e.g. 'port')
+    '''
+    gstats = {}
+    for u, chunkstats in zip(units, stats):
+       name = u[6].split('_data_')[-1]
+       if name in gstats:
+          for g, s in zip(gstats[name], chunkstats):
+             if s is not None:
+                g.merge(s)
+       else:
+          gstats[name] = list(chunkstats)
+    return gstats
 
-    if calcR ==1:
-       return Zt, R
-    else:
-       return Zt
- 
 # =========================================================
-def correct_scans(fp, r_fp):
-    Zt = []
-
-    for p in xrange(len(fp)):
-
-       mg = 10**np.log10(np.asarray(fp[p]*np.cos(r_fp[p]),'float32')+0.001)
-       mg[fp[p]==0] = np.nan
+def correct_unit(infile, shape, p, Zbed, r_fp, maxW, root, dofilt=0):
+    '''
+    remove water column and radiometrically correct chunk p of the scan
+    in memory-mapped file infile, writing it into the (already allocated)
+    root+'_l.dat' and root+'_la.dat'. If r_fp is None no range correction
+    is applied (downward looking scans). If dofilt is 1 the corrected
+    scan is also filtered with ppdrc (and left unscaled, see rescale_unit)
+
+    returns the statistics (humutils.EchoStats) of the chunk in _l and _la,
+    to be merged across chunks. The water column and the pings padding 
+    the last chunk are left out of them
+    '''
+    fp = np.memmap(infile, dtype='int16', mode='r', shape=shape)
+    l_fp = np.memmap(root+'_l.dat', dtype='float32', mode='r+', shape=shape)
+    la_fp = np.memmap(root+'_la.dat', dtype='float32', mode='r+', shape=shape)
 
-       Zt.append(mg)
+    if r_fp is None:
+       correct_chunk(fp[p], Zbed, None, maxW, l_fp[p], la_fp[p])
+    else:
+       correct_chunk(fp[p], Zbed, r_fp[p], maxW, l_fp[p], la_fp[p])
+
+    if dofilt==1:
+       dat = la_fp[p].copy()
+       mask = np.isnan(dat)
+       dat[mask] = 0
+       # phase preserving dynamic range compression, in tiles of fixed 
+       # memory use whatever the size of the chunk
+       dat = ppdrc.ppdrc_tiles(dat, int(shape[-1]/4), 2)
+       dat[mask] = np.nan
+       la_fp[p] = dat
+       del dat, mask
+
+    # pings in this chunk (the rest is padding)
+    nb = min(len(Zbed), shape[-1])
+    dBmax = 10*np.log10(maxW)
+    l = l_fp[p][:,:nb]
+    l_stats = humutils.EchoStats(0, dBmax).push(l[l!=0])
+    # the compressed scan is within +/- the log of its local energy,
+    # well inside +/- dBmax
+    if dofilt==1:
+       la_stats = humutils.EchoStats(-dBmax, dBmax).push(la_fp[p][:,:nb])
+    else:
+       la_stats = humutils.EchoStats(0, dBmax).push(la_fp[p][:,:nb])
 
-    return Zt
+    del fp, l_fp, la_fp, l # flush data to file
+    return l_stats, la_stats
 
 # =========================================================
-def correct_scans2(fp):
-    Zt = []
-
-    for p in xrange(len(fp)):
+def rescale_unit(root, shape, p, nb, stats):
+    '''
+    rescale chunk p of the filtered scan root+'_la.dat' to 0-255, by the
+    global min and max of the scan in stats (humutils.EchoStats)
 
-       mg = 10**np.log10(np.asarray(fp[p],'float32')+0.001)
-       mg[fp[p]==0] = np.nan
+    returns the statistics of the rescaled chunk (first nb pings)
+    '''
+    la_fp = np.memmap(root+'_la.dat', dtype='float32', mode='r+', shape=shape)
+    la_fp[p] = humutils.rescale(la_fp[p],0,255,stats)
+    la_stats = humutils.EchoStats(0, 255).push(la_fp[p][:,:min(nb, shape[-1])])
+    del la_fp # flush data to file
+    return la_stats
 
-       Zt.append(mg)
+# =========================================================
+def correct_chunk(dat, Zbed, r, maxW, out_l, out_la, buf=None):
+    '''
+    water column removal (each ping shifted up by its bed pick) and range
+    correction (by the cosine of range r, none if r is None) of one chunk,
+    in one pass, in float32. The water column removed scan is written to 
+    out_l and the corrected scan to out_la, in place.
 
-    return Zt
+    10**np.log10(x+0.001) is just x+0.001 where x+0.001 > 0, so no
+    transcendental calls are made other than the cosine of range
+    '''
+    nrows, ncols = np.shape(dat)
+    Zbed = np.asarray(Zbed,'int')[:ncols]
+    nb = len(Zbed)
+    scale = np.float32(10*np.log10(maxW)/255)
+
+    # dB scaling and bed shift, one ping at a time by slicing straight into
+    # out_l, so no index arrays or temporaries the size of the chunk are
+    # made. Pings with no bed pick are set to one
+    for k in xrange(nb):
+       z = Zbed[k]
+       col = out_l[:,k]
+       if z >= 0:
+          n = nrows-z if z < nrows else 0
+          np.multiply(dat[z:z+n,k], scale, out=col[:n])
+          col[n:] = 0
+       else:
+          n = nrows+z if -z < nrows else 0
+          col[:nrows-n] = 0
+          np.multiply(dat[:n,k], scale, out=col[nrows-n:])
+    out_l[:,nb:] = 1
+
+    # range correction and masking
+    if r is None:
+       out_la[:] = out_l
+    else:
+       if buf is None:
+          buf = np.empty((nrows, ncols), dtype='float32')
+       np.cos(r, out=buf)
+       np.multiply(out_l, buf, out=out_la)
+    out_la += np.float32(0.001)
+    out_la[out_la < 0] = np.nan
+    out_la[out_l == 0] = np.nan
 
 # =========================================================
-def plot_merged_scans(dat_port, dat_star, dist_m, shape_port, ft, sonpath, p):
+def plot_merged_scans(dat_port, dat_star, dist_m, shape_port, ft, sonpath, p, clim=(None, None)):
 
    Zdist = dist_m[shape_port[-1]*p:shape_port[-1]*(p+1)]
    extent = shape_port[1] #np.shape(merge)[0]
 
    fig = plt.figure()
-   plt.imshow(np.vstack((np.flipud(dat_port), dat_star)), cmap='gray', extent=[min(Zdist), max(Zdist), -extent*(1/ft), extent*(1/ft)])
+   plt.imshow(np.vstack((np.flipud(dat_port), dat_star)), cmap='gray', vmin=clim[0], vmax=clim[1], extent=[min(Zdist), max(Zdist), -extent*(1/ft), extent*(1/ft)])
    plt.ylabel('Range (m)'), plt.xlabel('Distance along track (m)')
 
    plt.axis('normal'); plt.axis('tight')
@@ -495,13 +491,13 @@ def plot_merged_scans(dat_port, dat_star, dist_m, shape_port, ft, sonpath, p):
    del fig
 
 # =========================================================
-def plot_dwnlow_scans(dat_dwnlow, dist_m, shape_low, ft, sonpath, p):
+def plot_dwnlow_scans(dat_dwnlow, dist_m, shape_low, ft, sonpath, p, clim=(None, None)):
 
     Zdist = dist_m[shape_low[-1]*p:shape_low[-1]*(p+1)]
     extent = shape_low[1] #np.shape(merge)[0]
    
     fig = plt.figure()
-    plt.imshow(dat_dwnlow, cmap='gray', extent=[min(Zdist), max(Zdist), extent*(1/ft), 0])
+    plt.imshow(dat_dwnlow, cmap='gray', vmin=clim[0], vmax=clim[1], extent=[min(Zdist), max(Zdist), extent*(1/ft), 0])
     plt.ylabel('Range (m)'), plt.xlabel('Distance along track (m)')
 
     plt.axis('normal'); plt.axis('tight')
@@ -509,13 +505,13 @@ def plot_dwnlow_scans(dat_dwnlow, dist_m, shape_low, ft, sonpath, p):
     del fig
 
 # =========================================================
-def plot_dwnhi_scans(dat_dwnhi, dist_m, shape_hi, ft, sonpath, p):
+def plot_dwnhi_scans(dat_dwnhi, dist_m, shape_hi, ft, sonpath, p, clim=(None, None)):
 
     Zdist = dist_m[shape_hi[-1]*p:shape_hi[-1]*(p+1)]
     extent = shape_hi[1] #np.shape(merge)[0]
    
     fig = plt.figure()
-    plt.imshow(dat_dwnhi, cmap='gray', extent=[min(Zdist), max(Zdist), extent*(1/ft), 0])
+    plt.imshow(dat_dwnhi, cmap='gray', vmin=clim[0], vmax=clim[1], extent=[min(Zdist), max(Zdist), extent*(1/ft), 0])
     plt.ylabel('Range (m)'), plt.xlabel('Distance along track (m)')
 
     plt.axis('normal'); plt.axis('tight')
@@ -88,6 +88,7 @@ __all__ = [
     'custom_save',
     'distBetweenPoints',
     'makechunks',
+    'write_chunks',
     'plot_2bedpicks',
     'plot_bedpick',
     ]
@@ -323,14 +324,14 @@ def read(humfile, sonpath, cs2cs_args, c, draft, doplot, t, f, bedpick, flip_lr,
     if not sonfiles:
         sonfiles = glob.glob(os.getcwd()+os.sep+sonpath+'*.SON')
 
-    print "WARNING: Because files have to be read in byte by byte,"
-    print "this could take a very long time ..."
-
     data = pyread.pyread(sonfiles, humfile, c, model, cs2cs_args)
 
     dat = data.gethumdat() 
     metadat = data.getmetadata()
 
+    # statistics (humutils.EchoStats) of each channel written
+    stats = {}
+
     try:
        if flip_lr==0:
           data_port = data.getportscans().astype('int16')
@@ -340,10 +341,8 @@ def read(humfile, sonpath, cs2cs_args, c, draft, doplot, t, f, bedpick, flip_lr,
        Zt, ind_port = makechunks(data_port, chunksize)
        del data_port
 
-       # create memory mapped file for Z
-       fp = np.memmap(sonpath+base+'_data_port.dat', dtype='int16', mode='w+', shape=np.shape(Zt))
-       fp[:] = Zt[:]
-       del fp
+       # create memory mapped file for Z, and the statistics of its chunks
+       stats['port'] = write_chunks(sonpath+base+'_data_port.dat', Zt)
        shape_port = np.shape(Zt)
        del Zt
        #we are only going to access the portion of memory required
@@ -362,10 +361,8 @@ def read(humfile, sonpath, cs2cs_args, c, draft, doplot, t, f, bedpick, flip_lr,
        Zt, ind_star = makechunks(data_star, chunksize)
        del data_star
 
-       # create memory mapped file for Z
-       fp = np.memmap(sonpath+base+'_data_star.dat', dtype='int16', mode='w+', shape=np.shape(Zt))
-       fp[:] = Zt[:]
-       del fp
+       # create memory mapped file for Z, and the statistics of its chunks
+       stats['star'] = write_chunks(sonpath+base+'_data_star.dat', Zt)
        shape_star = np.shape(Zt)
        del Zt
        #we are only going to access the portion of memory required
@@ -386,10 +383,8 @@ def read(humfile, sonpath, cs2cs_args, c, draft, doplot, t, f, bedpick, flip_lr,
              for k in xrange(len(tmp)):
                  tmp2[k] = tmp[k][:,:np.shape(star_fp[k])[1]]
              del tmp
-             # create memory mapped file for Z
-             fp = np.memmap(sonpath+base+'_data_port.dat', dtype='int16', mode='w+', shape=np.shape(tmp2))
-             fp[:] = tmp2[:]
-             del fp
+             # create memory mapped file for Z, and the statistics of its chunks
+             stats['port'] = write_chunks(sonpath+base+'_data_port.dat', tmp2)
              shape_port = np.shape(tmp2)
              del tmp2
              #we are only going to access the portion of memory required
@@ -404,10 +399,8 @@ def read(humfile, sonpath, cs2cs_args, c, draft, doplot, t, f, bedpick, flip_lr,
              for k in xrange(len(tmp)):
                  tmp2[k] = tmp[k][:,:np.shape(port_fp[k])[1]]
              del tmp
-             # create memory mapped file for Z
-             fp = np.memmap(sonpath+base+'_data_star.dat', dtype='int16', mode='w+', shape=np.shape(tmp2))
-             fp[:] = tmp2[:]
-             del fp
+             # create memory mapped file for Z, and the statistics of its chunks
+             stats['star'] = write_chunks(sonpath+base+'_data_star.dat', tmp2)
              shape_star = np.shape(tmp2)
              del tmp2
              #we are only going to access the portion of memory required
@@ -426,10 +419,8 @@ def read(humfile, sonpath, cs2cs_args, c, draft, doplot, t, f, bedpick, flip_lr,
           Zt, ind_low = makechunks(data_dwnlow, chunksize)
        del data_dwnlow
 
-       # create memory mapped file for Z
-       fp = np.memmap(sonpath+base+'_data_dwnlow.dat', dtype='int16', mode='w+', shape=np.shape(Zt))
-       fp[:] = Zt[:]
-       del fp
+       # create memory mapped file for Z, and the statistics of its chunks
+       stats['dwnlow'] = write_chunks(sonpath+base+'_data_dwnlow.dat', Zt)
        shape_low = np.shape(Zt)
        del Zt
        #we are only going to access the portion of memory required
@@ -448,10 +439,8 @@ def read(humfile, sonpath, cs2cs_args, c, draft, doplot, t, f, bedpick, flip_lr,
           Zt, ind_hi = makechunks(data_dwnhi, chunksize)
        del data_dwnhi
 
-       # create memory mapped file for Z
-       fp = np.memmap(sonpath+base+'_data_dwnhi.dat', dtype='int16', mode='w+', shape=np.shape(Zt))
-       fp[:] = Zt[:]
-       del fp
+       # create memory mapped file for Z, and the statistics of its chunks
+       stats['dwnhi'] = write_chunks(sonpath+base+'_data_dwnhi.dat', Zt)
        shape_hi = np.shape(Zt)
        del Zt
        #we are only going to access the portion of memory required
@@ -472,10 +461,8 @@ def read(humfile, sonpath, cs2cs_args, c, draft, doplot, t, f, bedpick, flip_lr,
              for k in xrange(len(tmp)):
                  tmp2[k] = tmp[k][:,:np.shape(dwnlow_fp[k])[1]]
              del tmp
-             # create memory mapped file for Z
-             fp = np.memmap(sonpath+base+'_data_dwnhi.dat', dtype='int16', mode='w+', shape=np.shape(tmp2))
-             fp[:] = tmp2[:]
-             del fp
+             # create memory mapped file for Z, and the statistics of its chunks
+             stats['dwnhi'] = write_chunks(sonpath+base+'_data_dwnhi.dat', tmp2)
              shape_dwnhi = np.shape(tmp2)
              del tmp2
              #we are only going to access the portion of memory required
@@ -490,10 +477,8 @@ def read(humfile, sonpath, cs2cs_args, c, draft, doplot, t, f, bedpick, flip_lr,
              for k in xrange(len(tmp)):
                  tmp2[k] = tmp[k][:,:np.shape(dwnhi_fp[k])[1]]
              del tmp
-             # create memory mapped file for Z
-             fp = np.memmap(sonpath+base+'_data_dwnlow.dat', dtype='int16', mode='w+', shape=np.shape(tmp2))
-             fp[:] = tmp2[:]
-             del fp
+             # create memory mapped file for Z, and the statistics of its chunks
+             stats['dwnlow'] = write_chunks(sonpath+base+'_data_dwnlow.dat', tmp2)
              shape_dwnlow = np.shape(tmp2)
              del tmp2
              #we are only going to access the portion of memory required
@@ -548,6 +533,11 @@ def read(humfile, sonpath, cs2cs_args, c, draft, doplot, t, f, bedpick, flip_lr,
     else:
        metadat['shape_low'] = ''   
 
+    # statistics of each channel, accumulated chunk by chunk as they were
+    # written, so later stages can normalise every chunk the same way
+    for name in stats:
+       metadat.update(stats[name].todict(name))
+
     try:
        import simplekml
        # create kml for loading path into google earth
@@ -580,6 +570,9 @@ def read(humfile, sonpath, cs2cs_args, c, draft, doplot, t, f, bedpick, flip_lr,
 
     if 'port_fp' in locals() and 'star_fp' in locals():
 
+       # plot every chunk on the same grey scale, from the global statistics
+       clim = (min(stats['port'].min, stats['star'].min), max(stats['port'].max, stats['star'].max))
+
        if bedpick == 1: # auto
 
           # get bed from depth trace
@@ -607,7 +600,7 @@ def read(humfile, sonpath, cs2cs_args, c, draft, doplot, t, f, bedpick, flip_lr,
 
           if doplot==1:
              for k in xrange(len(star_fp)):
-                plot_2bedpicks(port_fp[k], star_fp[k], bed[ind_port[-1]*k:ind_port[-1]*(k+1)], dist_m[ind_port[-1]*k:ind_port[-1]*(k+1)], x[ind_port[-1]*k:ind_port[-1]*(k+1)], ft, shape_port, sonpath, k)
+                plot_2bedpicks(port_fp[k], star_fp[k], bed[ind_port[-1]*k:ind_port[-1]*(k+1)], dist_m[ind_port[-1]*k:ind_port[-1]*(k+1)], x[ind_port[-1]*k:ind_port[-1]*(k+1)], ft, shape_port, sonpath, k, clim)
 
           # 'real' bed is estimated to be the minimum of the two
           #bed = np.max(np.vstack((bed,np.squeeze(x))),axis=0) 
@@ -639,7 +632,7 @@ def read(humfile, sonpath, cs2cs_args, c, draft, doplot, t, f, bedpick, flip_lr,
        if doplot==1:
 
           for k in xrange(len(star_fp)):
-             plot_bedpick(port_fp[k], star_fp[k], (1/ft)*bed[ind_port[-1]*k:ind_port[-1]*(k+1)], dist_m[ind_port[-1]*k:ind_port[-1]*(k+1)], ft, shape_port, sonpath, k)
+             plot_bedpick(port_fp[k], star_fp[k], (1/ft)*bed[ind_port[-1]*k:ind_port[-1]*(k+1)], dist_m[ind_port[-1]*k:ind_port[-1]*(k+1)], ft, shape_port, sonpath, k, clim)
 
 
        metadat['bed'] = bed[:nrec]
@@ -702,7 +695,7 @@ def read(humfile, sonpath, cs2cs_args, c, draft, doplot, t, f, bedpick, flip_lr,
 
           for k in xrange(len(dwnlow_fp)):
              fig = plt.figure()
-             plt.imshow(dwnlow_fp[k],cmap='gray')
+             plt.imshow(dwnlow_fp[k],cmap='gray', vmin=stats['dwnlow'].min, vmax=stats['dwnlow'].max)
              plt.axis('normal'); plt.axis('tight')
              plt.xlabel('Ping Number (Time)')
              plt.ylabel('Range (Distance)')
@@ -714,7 +707,7 @@ def read(humfile, sonpath, cs2cs_args, c, draft, doplot, t, f, bedpick, flip_lr,
 
           for k in xrange(len(dwnhi_fp)):
              fig = plt.figure()
-             plt.imshow(dwnhi_fp[k],cmap='gray')
+             plt.imshow(dwnhi_fp[k],cmap='gray', vmin=stats['dwnhi'].min, vmax=stats['dwnhi'].max)
              plt.axis('normal'); plt.axis('tight')
              plt.xlabel('Ping Number (Time)')
              plt.ylabel('Range (Distance)')
@@ -771,7 +764,22 @@ def makechunks(dat, chunksize=0):
 
 
 # =========================================================
-def plot_2bedpicks(dat_port, dat_star, Zbed, Zdist, Zx, ft, shape_port, sonpath, k):
+def write_chunks(outfile, Zt):
+   '''
+   write the chunks Zt into int16 memory-mapped file outfile, and return
+   their statistics (humutils.EchoStats), pushed chunk by chunk as each 
+   is written
+   '''
+   stats = humutils.EchoStats(0, 255)
+   fp = np.memmap(outfile, dtype='int16', mode='w+', shape=np.shape(Zt))
+   for k in xrange(len(Zt)):
+      fp[k] = Zt[k]
+      stats.push(Zt[k])
+   del fp
+   return stats
+
+# =========================================================
+def plot_2bedpicks(dat_port, dat_star, Zbed, Zdist, Zx, ft, shape_port, sonpath, k, clim=(None, None)):
 
    extent = shape_port[1] #np.shape(merge)[0]
 
@@ -779,20 +787,20 @@ def plot_2bedpicks(dat_port, dat_star, Zbed, Zdist, Zx, ft, shape_port, sonpath,
    fig.subplots_adjust(wspace = 0.1, hspace=0.1)
    plt.subplot(2,2,1)
    ax = plt.gca()
-   im = ax.imshow(np.flipud(dat_port),cmap='gray',extent=[min(Zdist), max(Zdist), 0, extent*(1/ft)],origin='upper')
+   im = ax.imshow(np.flipud(dat_port),cmap='gray',vmin=clim[0],vmax=clim[1],extent=[min(Zdist), max(Zdist), 0, extent*(1/ft)],origin='upper')
    plt.ylabel('Range (m)'); #plt.xlabel('Distance along track (m)')  
    plt.axis('normal'); plt.axis('tight')
 
    plt.subplot(2,2,3)
    ax = plt.gca()
-   im = ax.imshow(dat_star,cmap='gray',extent=[min(Zdist), max(Zdist), extent*(1/ft), 0],origin='upper')
+   im = ax.imshow(dat_star,cmap='gray',vmin=clim[0],vmax=clim[1],extent=[min(Zdist), max(Zdist), extent*(1/ft), 0],origin='upper')
    plt.ylabel('Range (m)'); plt.xlabel('Distance along track (m)')
    plt.axis('normal'); plt.axis('tight')
 
    axR=plt.subplot(1,2,2); 
    axR.yaxis.tick_right()
    axR.yaxis.set_label_position("right")
-   axR.imshow(dat_star,cmap='gray',extent=[min(Zdist), max(Zdist), extent*(1/ft), 0],origin='upper')
+   axR.imshow(dat_star,cmap='gray',vmin=clim[0],vmax=clim[1],extent=[min(Zdist), max(Zdist), extent*(1/ft), 0],origin='upper')
    plt.plot(Zdist,Zbed/ft,'k')
    plt.plot(Zdist,Zx[:len(Zdist)]/ft,'r')
    plt.axis('normal'); plt.axis('tight')
@@ -802,19 +810,19 @@ def plot_2bedpicks(dat_port, dat_star, Zbed, Zdist, Zx, ft, shape_port, sonpath,
    plt.close(); del fig
 
 # =========================================================
-def plot_bedpick(dat_port, dat_star, Zbed, Zdist, ft, shape_port, sonpath, k):
+def plot_bedpick(dat_port, dat_star, Zbed, Zdist, ft, shape_port, sonpath, k, clim=(None, None)):
 
    extent = shape_port[1] #np.shape(merge)[0]
 
    fig = plt.figure()
    plt.subplot(2,2,1)
-   plt.imshow(np.flipud(dat_star),cmap='gray', extent=[min(Zdist), max(Zdist), 0, extent*(1/ft)], origin='upper')
+   plt.imshow(np.flipud(dat_star),cmap='gray', vmin=clim[0], vmax=clim[1], extent=[min(Zdist), max(Zdist), 0, extent*(1/ft)], origin='upper')
    plt.plot(np.linspace(min(Zdist), max(Zdist),len(Zbed)), Zbed,'r')
    plt.axis('normal'); plt.axis('tight')
    plt.ylabel('Range (m)'); plt.xlabel('Distance along track (m)')
 
    plt.subplot(2,2,3)
-   plt.imshow(dat_port,cmap='gray', extent=[min(Zdist), max(Zdist), extent*(1/ft), 0], origin='upper')
+   plt.imshow(dat_port,cmap='gray', vmin=clim[0], vmax=clim[1], extent=[min(Zdist), max(Zdist), extent*(1/ft), 0], origin='upper')
    plt.plot(np.linspace(min(Zdist), max(Zdist),len(Zbed)), Zbed,'r')
    plt.axis('normal'); plt.axis('tight')
    plt.ylabel('Range (m)'); plt.xlabel('Distance along track (m)')
@@ -55,9 +55,10 @@
 # =========================================================
 
 # operational
-import sys, getopt, os, time
+import sys, getopt, os, time, hashlib
 from scipy.io import loadmat, savemat
 from joblib import Parallel, delayed, cpu_count
+from multiprocessing.pool import ThreadPool
 try:
    from Tkinter import Tk
    from tkFileDialog import askopenfilename, askdirectory
@@ -70,6 +71,7 @@ warnings.simplefilter('ignore', RuntimeWarning)
 import numpy as np
 import cwt
 import replace_nans
+import median
 import PyHum.utils as humutils
 from scipy.ndimage.filters import median_filter
 
@@ -92,10 +94,21 @@ __all__ = [
     'texture',
     'custom_save',
     'parallel_me',
+    'load_chunk',
+    'chunk_lengthscales',
+    'postprocess',
+    'range_field',
+    'range_chunk',
+    'texture_chunk',
+    'lengthscales',
+    'parallel_windows',
+    'batchsize',
+    'coarse_nodes',
+    'adaptive_refine',
     ]
 
 #################################################
-def texture(humfile, sonpath, win, shift, doplot, density, numclasses, maxscale, notes):
+def texture(humfile, sonpath, win, shift, doplot, density, numclasses, maxscale, notes, numproc=0, nbatch=0, minvalid=0, tol=0, chunkpar=0, fastmed=1, estimator='cwt', threads=0):
           
       '''
       Create a texture lengthscale map using the algorithm detailed by Buscombe et al. (forthcoming)
@@ -106,7 +119,7 @@ def texture(humfile, sonpath, win, shift, doplot, density, numclasses, maxscale,
 
       Syntax
       ----------
-      [] = PyHum.texture(humfile, sonpath, win, shift, doplot, density, numclasses, maxscale, notes)
+      [] = PyHum.texture(humfile, sonpath, win, shift, doplot, density, numclasses, maxscale, notes, numproc, nbatch, minvalid, tol, chunkpar, fastmed, estimator, threads)
 
       Parameters
       ----------
@@ -114,8 +127,9 @@ def texture(humfile, sonpath, win, shift, doplot, density, numclasses, maxscale,
        path to the .DAT file
       sonpath : str
        path where the *.SON files are
-      win : int, *optional* [Default=100]
-       pixel in pixels of the moving window
+      win : int or list of int, *optional* [Default=100]
+       pixel in pixels of the moving window. If a list, a lengthscale map
+       is made for each window size in one pass over the echogram
       shift : int, *optional* [Default=10]
        shift in pixels for moving window operation
       doplot : int, *optional* [Default=1]
@@ -123,19 +137,68 @@ def texture(humfile, sonpath, win, shift, doplot, density, numclasses, maxscale,
       density : int, *optional* [Default=win/2]
        echogram will be sampled every 'density' pixels
       numclasses : int, *optional* [Default=4]
-       number of 'k means' that the texture lengthscale will be segmented into
+       number of 'k means' that the texture lengthscale will be segmented into.
+       Only valid (non-zero) lengthscales are clustered, and places with no
+       data get their own label (255). Earlier versions set no data to
+       zero and fitted numclasses+1 means, one of which went on the zeros;
+       the number of classes of data is the same
       maxscale : int, *optional* [Default=20]
        Max scale as inverse fraction of data length for wavelet analysis
       notes : int, *optional* [Default=100]
        notes per octave for wavelet analysis
+      numproc : int, *optional* [Default=number of processors]
+       number of worker processes, kept for the whole run
+      nbatch : int, *optional* [Default=as many as fit in about 64 MB]
+       number of windows given to a worker at a time
+      minvalid : float, *optional* [Default=0]
+       windows with less than this fraction of valid (not NaN) pixels,
+       e.g. in the water column, are skipped (their lengthscale is NaN).
+       0 transforms every window, as earlier versions did; 0.5 saves the
+       time spent on windows that are mostly water column
+      tol : float, *optional* [Default=0]
+       if > 0, adaptive sampling: lengthscales are first computed on a grid
+       of every 4th window, and windows are only computed in between where
+       the 4 surrounding estimates differ by more than tol (as a fraction of
+       their mean); elsewhere they are interpolated. 0 = every window
+      chunkpar : int, *optional* [Default=0]
+       1 = chunk-level parallelism: each worker processes whole chunks.
+       0 = window-level parallelism: the workers share the windows of each
+       chunk, while the next chunk is loaded and the previous one is 
+       post-processed in background threads
+      fastmed : int, *optional* [Default=1]
+       1 = the lengthscale grid is smoothed with a histogram-based running
+       median (see median.median_filter), whose cost does not depend on the
+       window size. 0 = exact median (scipy.ndimage.median_filter)
+      estimator : str, *optional* [Default='cwt']
+       'cwt' = the wavelet lengthscale. 'microscale' = a fast estimate for
+       quick looks: the sum over both axes of the Taylor microscale of each
+       window (the ratio of the standard deviations of the echogram and of
+       its pixel to pixel differences, see humutils.window_microscale). 
+       The maps are on the same grid and post-processed the same way
+      threads : int, *optional* [Default=0]
+       1 = the numproc workers are threads of this process, sharing its
+       memory. 0 = the workers are separate processes
 
       Returns
       -------
       sonpath+base+'_data_class.dat': memory-mapped file
-        contains the texture lengthscale map
+        contains the texture lengthscale map (of the first window size)
+
+      sonpath+base+'_data_class_layers.dat': memory-mapped file
+        if win is a list, contains the texture lengthscale map of each
+        window size, in that order (shape (len(win),)+shape of 
+        _data_class.dat). The window sizes are stored in meta.mat 
+        as 'texture_win'
 
       sonpath+base+'_data_kclass.dat': memory-mapped file
-        contains the k-means segmented texture lengthscale map
+        contains the k-means segmented texture lengthscale map, as uint8
+        class labels (255 where there is no data). The centres of the
+        classes, the same for all chunks, are in meta.mat as 
+        'kmeans_centres' (see humutils.decode_kmeans)
+
+      sonpath+base+'_data_range_filled.dat': memory-mapped file
+        contains the inpainted range field used to correct the lengthscales,
+        kept for reruns on the same recording
 
       References
       ----------
@@ -161,8 +224,8 @@ def texture(humfile, sonpath, win, shift, doplot, density, numclasses, maxscale,
          print 'Input file is %s' % (humfile)
       if sonpath:
          print 'Sonar file path is %s' % (sonpath)
-      if win:
-         win = np.asarray(win,int)
+      if np.any(win):
+         win = np.atleast_1d(np.asarray(win,int))
          print 'Window is %s square pixels' % (str(win))
       if shift:
          shift = np.asarray(shift,int)
@@ -183,12 +246,40 @@ def texture(humfile, sonpath, win, shift, doplot, density, numclasses, maxscale,
          doplot = int(doplot)
          if doplot==0:
             print "Plots will not be made"    
-      
-      
-      print '[Default] Number of processors is %s' % (str(cpu_count()))
-
-      if not win:
-         win = 100
+      if numproc:
+         numproc = int(numproc)
+         print 'Number of processors is %s' % (str(numproc))
+      if nbatch:
+         nbatch = int(nbatch)
+         print 'Windows per batch: %s' % (str(nbatch))
+      if minvalid:
+         minvalid = float(minvalid)
+         print 'Windows less than %s valid will be skipped' % (str(minvalid))
+      if tol:
+         tol = float(tol)
+         print 'Adaptive sampling with a tolerance of %s' % (str(tol))
+      if chunkpar:
+         chunkpar = int(chunkpar)
+         if chunkpar==1:
+            print "Chunks will be processed in parallel"
+      if estimator:
+         estimator = str(estimator)
+         print 'Lengthscale estimator: %s' % (estimator)
+      if fastmed:
+         fastmed = int(fastmed)
+         if fastmed==1:
+            print "Fast running median will be used"
+      if threads:
+         threads = int(threads)
+         if threads==1:
+            print "Workers will be threads"
+
+      if not numproc:
+         numproc = cpu_count()
+         print '[Default] Number of processors is %s' % (str(numproc))
+
+      if not np.any(win):
+         win = np.atleast_1d(100)
          print '[Default] Window is %s square pixels' % (str(win))
 
       if not shift:
@@ -198,6 +289,7 @@ def texture(humfile, sonpath, win, shift, doplot, density, numclasses, maxscale,
       if not density:
          density = win/2
          print '[Default] Echogram will be sampled every %s pixels' % (str(density))
+      density = density*np.ones(len(win),int)
 
       if not numclasses:
          numclasses = 4
@@ -216,6 +308,36 @@ def texture(humfile, sonpath, win, shift, doplot, density, numclasses, maxscale,
             doplot = 1
             print "[Default] Plots will be made"
 
+      if not minvalid:
+         minvalid = 0
+         print "[Default] No windows will be skipped"
+
+      if not chunkpar:
+         chunkpar = 0
+         print "[Default] Windows of each chunk will be processed in parallel"
+
+      if not fastmed:
+         if fastmed != 0:
+            fastmed = 1
+            print "[Default] Fast running median will be used"
+
+      if not estimator:
+         estimator = 'cwt'
+         print '[Default] Lengthscale estimator: %s' % (estimator)
+
+      if not threads:
+         threads = 0
+         print "[Default] Workers will be processes"
+
+      if estimator not in ['cwt','microscale']:
+         print "estimator must be 'cwt' or 'microscale'"
+         return
+
+      if not nbatch:
+         nbatch = [batchsize(win[k], maxscale, notes, density[k]) for k in xrange(len(win))]
+         print '[Default] Windows per batch: %s' % (str(nbatch))
+      nbatch = nbatch*np.ones(len(win),int)
+
       ########################################################
       ########################################################
       
@@ -236,6 +358,8 @@ def texture(humfile, sonpath, win, shift, doplot, density, numclasses, maxscale,
       pix_m = np.squeeze(loadmat(sonpath+base+'meta.mat')['pix_m'])
       dep_m = np.squeeze(loadmat(sonpath+base+'meta.mat')['dep_m'])
       dist_m = np.squeeze(loadmat(sonpath+base+'meta.mat')['dist_m'])
+      bed = np.squeeze(loadmat(sonpath+base+'meta.mat')['bed'])
+      bed = np.asarray(bed,'int')+int(0.25*ft)
 
       ### port
       print "processing port side ..."
@@ -256,99 +380,70 @@ def texture(humfile, sonpath, win, shift, doplot, density, numclasses, maxscale,
       shape = shape_port.copy()
       shape[1] = shape_port[1] + shape_star[1]
 
-      # create memory mapped file for Sp
-      fp = np.memmap(sonpath+base+'_data_class.dat', dtype='float32', mode='w+', shape=tuple(shape))
-
-      #SRT = []
-      for p in xrange(len(port_fp)):
-
-         Z,ind = humutils.sliding_window(np.vstack((np.flipud(port_fp[p]), star_fp[p])),(win,win),(shift,shift))
-
-         try:
-            print "%s windows to process with a density of %s" % (str(len(Z)), str(density)) #% (str(len(Z)), str(density))
-            # do the wavelet clacs and get the stats
-            d = Parallel(n_jobs = -1, verbose=0)(delayed(parallel_me)(Z[k], maxscale, notes, win, density) for k in xrange(len(Z)))
-         except:
-            print "memory error: trying serial"
-            d = Parallel(n_jobs = 1, verbose=0)(delayed(parallel_me)(Z[k], maxscale, notes, win, density) for k in xrange(len(Z)))
-
-         srt = np.reshape(d , ( ind[0], ind[1] ) )
-         del d
-
-         try:
-            print "%s windows to process with a density of %s" % (str(len(Z)), str(density)) #% (str(len(Z)), str(density))
-            # do the wavelet clacs and get the stats
-            d = Parallel(n_jobs = -1, verbose=0)(delayed(parallel_me)(Z[k].T, maxscale, notes, win, density) for k in xrange(len(Z)))
-         except:
-            print "memory error: trying serial"
-            d = Parallel(n_jobs = 1, verbose=0)(delayed(parallel_me)(Z[k].T, maxscale, notes, win, density) for k in xrange(len(Z)))
-
-         srt2 = np.reshape(d , ( ind[0], ind[1] ) )
-         del d
-         Z = None
-
-         SRT = srt+srt2
-         del srt, srt2
-
-         Snn = SRT.copy() 
-         del SRT
-
-         # replace nans using infilling algorithm
-         rn = replace_nans.RN(Snn.astype('float64'),1000,0.01,2,'localmean')
-         Snn = rn.getdata()
-         del rn   
-
-         Ny, Nx = np.shape( np.vstack((np.flipud(port_fp[p]), star_fp[p])) )
-         Snn = median_filter(Snn,(int(Nx/100),int(Ny/100)))
-   
-         Sp = humutils.im_resize(Snn,Nx,Ny)
-         del Snn
-
-         Sp[np.isnan(np.vstack((np.flipud(port_fp[p]), star_fp[p])))] = np.nan
-         Sp[np.isnan(np.vstack((np.flipud(port_fp2[p]), star_fp2[p])))] = np.nan
-
-         extent = shape_port[1]
-         Zdist = dist_m[shape_port[-1]*p:shape_port[-1]*(p+1)]
-         yvec = np.linspace(pix_m,extent*pix_m,extent)
-         d = dep_m[shape_port[-1]*p:shape_port[-1]*(p+1)]
-
-         R_fp = np.memmap(sonpath+base+'_data_range.dat', dtype='float32', mode='r', shape=tuple(shape_star))
-
-         #R = np.ones(np.shape(Sp))
-         #for k in range(len(d)): 
-         #   R[:,k] = np.hstack((np.flipud(d[k]/yvec), d[k]/yvec))
-
-         #if len(d)<np.shape(port_fp[p])[1]:
-         #   d = np.append(d,d[-1])
-         #Zbed = np.squeeze(d*ft)
-
-         #R1 = R[extent:,:]
-         #R2 = np.flipud(R[:extent,:])
-
-         ## shift proportionally depending on where the bed is
-         #for k in xrange(np.shape(R1)[1]):
-         #   R1[:,k] = np.r_[R1[Zbed[k]:,k], np.zeros( (np.shape(R1)[0] -  np.shape(R1[Zbed[k]:,k])[0] ,) )]
+      # range geometry, as used by correct
+      R_fp = humutils.RangeGeometry(dep_m, pix_m, bed, shape_star)
 
-         #for k in xrange(np.shape(R2)[1]):
-         #   R2[:,k] = np.r_[R2[Zbed[k]:,k], np.zeros( (np.shape(R2)[0] -  np.shape(R2[Zbed[k]:,k])[0] ,) )]
+      if threads==1:
+         backend = 'threading'
+      else:
+         backend = 'multiprocessing'
 
-         #R = np.vstack((np.flipud(R2),R1))
-         #del R1, R2
+      # inpainted range field of every chunk, cached on disk
+      range_fp = range_field(sonpath, base, R_fp, numproc, backend)
 
-         R = np.vstack((np.flipud(R_fp[0]),R_fp[0]))
-         
-         R[R>0.8] = np.nan
-
-         rn = replace_nans.RN(R.astype('float64'),1000,0.01,2,'localmean')
-         R = rn.getdata()
-         del rn   
-
-         Sp = (Sp**2) * np.cos(R) / shift**2
-
-         fp[p] = Sp.astype('float32')
-         del Sp
-
-      del fp # flush data to file
+      # create memory mapped file for Sp
+      fp = np.memmap(sonpath+base+'_data_class.dat', dtype='float32', mode='w+', shape=tuple(shape))
+      del fp
+      if len(win)>1:
+         fp = np.memmap(sonpath+base+'_data_class_layers.dat', dtype='float32', mode='w+', shape=(len(win),)+tuple(shape))
+         del fp
+
+      if chunkpar==1:
+         # each worker does all the work for one chunk at a time
+         Parallel(n_jobs = numproc, backend = backend, verbose=0)(delayed(texture_chunk)(sonpath, base, tuple(shape_port), tuple(shape_star), p, range_fp[p], win, shift, density, maxscale, notes, nbatch, minvalid, tol, fastmed, estimator) for p in xrange(len(port_fp)))
+
+      else:
+         # the workers share the windows of one chunk at a time. Meanwhile, 
+         # a thread loads the next chunk and another post-processes (infills,
+         # smooths, upsamples and writes) the previous one
+         pool = ThreadPool(2)
+         loaded = pool.apply_async(load_chunk, (sonpath, base, tuple(shape_port), tuple(shape_star), 0))
+         posted = []
+
+         # one pool of workers for the whole run
+         with Parallel(n_jobs = numproc, backend = backend, verbose=0) as parallel:
+            for p in xrange(len(port_fp)):
+
+               merged, merged2 = loaded.get()
+               if p+1 < len(port_fp):
+                  loaded = pool.apply_async(load_chunk, (sonpath, base, tuple(shape_port), tuple(shape_star), p+1))
+
+               SRT = chunk_lengthscales(parallel, sonpath+base+'_data_merge'+str(p), merged, win, shift, density, maxscale, notes, nbatch, minvalid, tol, estimator)
+
+               # only one chunk is post-processed at a time, so only one is
+               # held in memory waiting, and errors are raised straight away
+               if p > 0:
+                  posted[p-1].get()
+               posted.append(pool.apply_async(postprocess, (sonpath, base, tuple(shape), p, SRT, merged, merged2, range_fp[p], shift, fastmed)))
+               del merged, merged2, SRT
+
+         if posted:
+            posted[-1].get()
+         pool.close()
+         del pool
+
+      meta = loadmat(sonpath+base+'meta.mat')
+      meta['texture_win'] = win
+      savemat(sonpath+base+'meta.mat', meta ,oned_as='row')
+
+      # plot every chunk on the same grey scale, from the global statistics
+      # of the scans saved by correct (if there)
+      clim = (None, None)
+      port_stats = humutils.EchoStats.fromdict(meta, 'port_la')
+      star_stats = humutils.EchoStats.fromdict(meta, 'star_la')
+      if port_stats is not None and star_stats is not None:
+         clim = (min(port_stats.min, star_stats.min), max(port_stats.max, star_stats.max))
+      del meta
 
       class_fp = np.memmap(sonpath+base+'_data_class.dat', dtype='float32', mode='r', shape=tuple(shape))
 
@@ -359,34 +454,38 @@ def texture(humfile, sonpath, win, shift, doplot, density, numclasses, maxscale,
       if doplot==1:
 
          for p in xrange(len(star_fp)):
-            plot_class(dist_m, shape_port, port_fp[p], star_fp[p], class_fp[p], ft, humfile, sonpath, base, p)
+            plot_class(dist_m, shape_port, port_fp[p], star_fp[p], class_fp[p], ft, humfile, sonpath, base, p, clim)
 
          for p in xrange(len(star_fp)):
             plot_contours(dist_m, shape_port, class_fp[p], ft, humfile, sonpath, base, numclasses, p)
 
 
       #######################################################
-      # k-means 
-      fp = np.memmap(sonpath+base+'_data_kclass.dat', dtype='float32', mode='w+', shape=tuple(shape))
-
+      # k-means, fitted once on a sample drawn evenly from all chunks, so
+      # every chunk is classified with the same centres. Labels are stored
+      # (uint8), and decoded into centres when needed
+      centres = humutils.fit_kmeans(humutils.kmeans_sample(class_fp),numclasses)
+      print "k-means centres: %s" % (str(centres))
+
+      fp = np.memmap(sonpath+base+'_data_kclass.dat', dtype='uint8', mode='w+', shape=tuple(shape))
+      step = max(2**20//shape[2], 1)
       for p in xrange(len(port_fp)):
-         Sk = class_fp[p].copy()
-         Sk[np.isnan(Sk)] = 0
-         wc, values = humutils.cut_kmeans(Sk,numclasses+1)
-         wc[Sk==0] = np.nan
-         del Sk
-         fp[p] = wc.astype('float32')
-         del wc
-
+         for i in xrange(0, shape[1], step):
+            fp[p,i:i+step] = humutils.predict_kmeans(class_fp[p,i:i+step],centres)
       del fp
 
-      kclass_fp = np.memmap(sonpath+base+'_data_kclass.dat', dtype='float32', mode='r', shape=tuple(shape))
+      meta = loadmat(sonpath+base+'meta.mat')
+      meta['kmeans_centres'] = centres
+      savemat(sonpath+base+'meta.mat', meta ,oned_as='row')
+      del meta
+
+      kclass_fp = np.memmap(sonpath+base+'_data_kclass.dat', dtype='uint8', mode='r', shape=tuple(shape))
 
       ########################################################
       if doplot==1:
 
          for p in xrange(len(star_fp)):
-            plot_kmeans(dist_m, shape_port, port_fp[p], star_fp[p], kclass_fp[p], ft, humfile, sonpath, base, p)
+            plot_kmeans(dist_m, shape_port, port_fp[p], star_fp[p], humutils.decode_kmeans(kclass_fp[p],centres), ft, humfile, sonpath, base, p, clim)
 
       if os.name=='posix': # true if linux/mac
          elapsed = (time.time() - start)
@@ -409,7 +508,293 @@ def parallel_me(x, maxscale, notes, win, density):
    return dat.getvar()
 
 # =========================================================
-def plot_class(dist_m, shape_port, dat_port, dat_star, dat_class, ft, humfile, sonpath, base, p):
+def load_chunk(sonpath, base, shape_port, shape_star, p):
+   '''
+   merged (flipped port over starboard) echograms of chunk p, radiometrically
+   corrected (_la) and with the water column removed only (_l)
+   '''
+   port_fp = np.memmap(sonpath+base+'_data_port_la.dat', dtype='float32', mode='r', shape=shape_port)
+   star_fp = np.memmap(sonpath+base+'_data_star_la.dat', dtype='float32', mode='r', shape=shape_star)
+   merged = np.vstack((np.flipud(port_fp[p]), star_fp[p]))
+   del port_fp, star_fp
+   port_fp = np.memmap(sonpath+base+'_data_port_l.dat', dtype='float32', mode='r', shape=shape_port)
+   star_fp = np.memmap(sonpath+base+'_data_star_l.dat', dtype='float32', mode='r', shape=shape_star)
+   merged2 = np.vstack((np.flipud(port_fp[p]), star_fp[p]))
+   del port_fp, star_fp
+   return merged, merged2
+
+# =========================================================
+def chunk_lengthscales(parallel, root, merged, win, shift, density, maxscale, notes, nbatch, minvalid, tol, estimator='cwt'):
+   '''
+   lengthscale grids of the merged echogram of a chunk, one per window size
+   in win. The echogram goes into a memory-mapped file (root+'.dat'), from
+   which the workers slice their own windows (see humutils.window_batch), so
+   overlapping windows are never copied all at once. It is shared by all 
+   window sizes. Temporary files are removed
+   '''
+   merge_fp = np.memmap(root+'.dat', dtype='float32', mode='w+', shape=np.shape(merged))
+   merge_fp[:] = merged
+   del merge_fp
+
+   SRT = []
+   for w in xrange(len(win)):
+      SRT.append(lengthscales(parallel, root+'.dat', np.shape(merged), root+'_srt.dat', win[w], shift, density[w], maxscale, notes, nbatch[w], minvalid, tol, estimator))
+
+   os.remove(root+'.dat')
+   if os.path.isfile(root+'_srt.dat'):
+      os.remove(root+'_srt.dat')
+   return SRT
+
+# =========================================================
+def postprocess(sonpath, base, shape, p, SRT, merged, merged2, R, shift, fastmed=1):
+   '''
+   turn the lengthscale grids (one per window size) of chunk p into maps:
+   infill, median filter, resize to the echogram, mask and correct for 
+   range (R, the chunk's inpainted range field, see range_field). The
+   median filter is histogram-based (median.median_filter) if fastmed is 1,
+   exact otherwise. It is applied on the window grid, before resizing. Maps
+   are resized (bicubic, see humutils.im_resize) and corrected tile by tile
+   in the memory-mapped output: the first is written into _data_class.dat
+   and, if there are several, all into _data_class_layers.dat
+   '''
+   for w in xrange(len(SRT)):
+      Snn = SRT[w].copy() 
+
+      # replace nans using infilling algorithm (coarse to fine, so wide 
+      # gaps are filled from their whole surroundings)
+      Snn = replace_nans.inpaint(Snn,'pyramid',2,'localmean',1000,0.01)
+
+      Ny, Nx = np.shape( merged )
+      if fastmed==1:
+         Snn = median.median_filter(Snn,(int(Nx/100),int(Ny/100)))
+      else:
+         Snn = median_filter(Snn,(int(Nx/100),int(Ny/100)))
+   
+      # resized tile by tile straight into the memory-mapped output (the
+      # layer if there are several, copied into _data_class.dat for the first)
+      if len(SRT)>1:
+         fp = np.memmap(sonpath+base+'_data_class_layers.dat', dtype='float32', mode='r+', shape=(len(SRT),)+shape)
+         Sp = fp[w,p]
+      else:
+         fp = np.memmap(sonpath+base+'_data_class.dat', dtype='float32', mode='r+', shape=shape)
+         Sp = fp[p]
+      humutils.im_resize(Snn,Nx,Ny,'bicubic',Sp)
+      del Snn
+
+      step = max(2**20//Nx, 1)
+      for i in xrange(0, Ny, step):
+         tile = Sp[i:i+step]
+         tile[np.isnan(merged[i:i+step]) | np.isnan(merged2[i:i+step])] = np.nan
+         tile[:] = (tile**2) * np.cos(R[i:i+step]) / shift**2
+
+      if w==0 and len(SRT)>1:
+         fp2 = np.memmap(sonpath+base+'_data_class.dat', dtype='float32', mode='r+', shape=shape)
+         fp2[p] = Sp
+         del fp2
+      del tile, Sp, fp # flush data to file
+
+# =========================================================
+def range_field(sonpath, base, R_fp, numproc=1, backend='multiprocessing'):
+   '''
+   range field of each chunk of the merged echogram, from R_fp (a
+   humutils.RangeGeometry) with values over 0.8 inpainted, in float32
+   memory-mapped file _data_range_filled.dat (which is returned, 
+   read-only). 
+
+   Chunks with the same geometry (depths and bed picks) have the same 
+   field, so it is only inpainted once for each distinct geometry, by 
+   numproc joblib workers (of the given backend). It is not computed at
+   all if the file already holds the field for this geometry (depths, bed
+   picks, pixel size and shape), as recorded in meta.mat ('range_key')
+   '''
+   nchunks, rows, cols = R_fp.shape
+   shape = (nchunks, 2*rows, cols)
+   key = hashlib.md5(R_fp.dep_m.tostring() + R_fp.bed.tostring() + str(R_fp.pix_m) + str(R_fp.shape) + 'float32').hexdigest()
+
+   meta = loadmat(sonpath+base+'meta.mat')
+   if 'range_key' in meta and os.path.isfile(sonpath+base+'_data_range_filled.dat'):
+      if str(np.squeeze(meta['range_key'])) == key:
+         print "Using cached range field"
+         return np.memmap(sonpath+base+'_data_range_filled.dat', dtype='float32', mode='r', shape=shape)
+
+   # first chunk with each geometry
+   first = {}
+   src = []
+   for p in xrange(nchunks):
+      ckey = hashlib.md5(R_fp.dep_m[cols*p:cols*(p+1)].tostring() + R_fp.bed[cols*p:cols*(p+1)].tostring()).hexdigest()
+      src.append(first.setdefault(ckey, p))
+
+   fp = np.memmap(sonpath+base+'_data_range_filled.dat', dtype='float32', mode='w+', shape=shape)
+   del fp
+   Parallel(n_jobs = numproc, backend = backend, verbose=0)(delayed(range_chunk)(sonpath+base+'_data_range_filled.dat', shape, R_fp, p) for p in sorted(first.values()))
+
+   fp = np.memmap(sonpath+base+'_data_range_filled.dat', dtype='float32', mode='r+', shape=shape)
+   for p in xrange(nchunks):
+      if src[p] != p:
+         fp[p] = fp[src[p]]
+   del fp
+
+   meta['range_key'] = key
+   savemat(sonpath+base+'meta.mat', meta ,oned_as='row')
+   del meta
+   return np.memmap(sonpath+base+'_data_range_filled.dat', dtype='float32', mode='r', shape=shape)
+
+# =========================================================
+def range_chunk(outfile, shape, R_fp, p):
+   '''
+   inpainted range field of chunk p (see range_field), written into
+   the (already allocated) memory-mapped file outfile
+   '''
+   R = np.vstack((np.flipud(R_fp[p]),R_fp[p]))
+   R[R>0.8] = np.nan
+   fp = np.memmap(outfile, dtype='float32', mode='r+', shape=shape)
+   fp[p] = replace_nans.inpaint(R,'pyramid',2,'localmean',1000,0.01)
+   del fp # flush data to file
+
+# =========================================================
+def texture_chunk(sonpath, base, shape_port, shape_star, p, R, win, shift, density, maxscale, notes, nbatch, minvalid, tol, fastmed=1, estimator='cwt'):
+   '''
+   all of the texture calculations for chunk p, in this process
+   '''
+   merged, merged2 = load_chunk(sonpath, base, shape_port, shape_star, p)
+   with Parallel(n_jobs = 1, verbose=0) as parallel:
+      SRT = chunk_lengthscales(parallel, sonpath+base+'_data_merge'+str(p), merged, win, shift, density, maxscale, notes, nbatch, minvalid, tol, estimator)
+   shape = (shape_port[0], shape_port[1]+shape_star[1], shape_port[2])
+   postprocess(sonpath, base, shape, p, SRT, merged, merged2, R, shift, fastmed)
+
+# =========================================================
+def lengthscales(parallel, mfile, shape, outfile, win, shift, density, maxscale, notes, nbatch, minvalid, tol, estimator='cwt'):
+   '''
+   lengthscale (sum of both orientations) of every sliding window of the
+   merged echogram in memory-mapped file mfile, on the window grid. 
+   Windows with less than minvalid valid pixels are skipped (NaN). Tasks
+   of nbatch windows are run by parallel (a joblib Parallel), and write 
+   into the (2, number of windows) memory-mapped file outfile. If tol > 0 
+   the windows are sampled coarse to fine (see adaptive_refine). If 
+   estimator is 'microscale', the fast humutils.window_microscale is used
+   instead, in this process
+   '''
+   # only windows with enough valid pixels are transformed
+   merge_fp = np.memmap(mfile, dtype='float32', mode='r', shape=shape)
+   valid = humutils.window_valid(merge_fp,(win,win),(shift,shift))
+   del merge_fp
+   ind = np.shape(valid)
+   nwin = ind[0]*ind[1]
+   valid = valid >= minvalid
+
+   if estimator=='microscale':
+      merge_fp = np.memmap(mfile, dtype='float32', mode='r', shape=shape)
+      SRT = humutils.window_microscale(merge_fp,(win,win),(shift,shift))
+      del merge_fp
+      SRT[~valid] = np.nan
+      print "%s windows skipped" % (str(nwin-valid.sum()))
+      return SRT
+
+   kvalid = np.flatnonzero(valid)
+
+   # windows are sent to the workers in contiguous batches of nbatch, each
+   # transformed in both orientations with one batched fft (see 
+   # cwt.cwt_var2). Lengthscales are written straight into a shared
+   # memory-mapped file
+   out_fp = np.memmap(outfile, dtype='float64', mode='w+', shape=(2, nwin))
+   out_fp[:] = np.nan
+   del out_fp
+
+   print "%s windows to process with a density of %s" % (str(len(kvalid)), str(density))
+   print "%s windows skipped" % (str(nwin-len(kvalid)))
+   if tol:
+      # coarse to fine: windows on a coarse grid first, then only those in
+      # coarse cells whose corner lengthscales differ by more than tol
+      coarse = np.zeros(ind, bool)
+      coarse[np.ix_(coarse_nodes(ind[0],4), coarse_nodes(ind[1],4))] = True
+      kvalid = np.flatnonzero(coarse & valid)
+      del coarse
+
+   # do the wavelet clacs and get the stats
+   parallel(delayed(parallel_windows)(mfile, shape, kvalid[k:k+nbatch], maxscale, notes, win, shift, density, outfile) for k in xrange(0, len(kvalid), nbatch))
+
+   if tol:
+      out_fp = np.memmap(outfile, dtype='float64', mode='r+', shape=(2, nwin))
+      kfine = adaptive_refine(np.reshape(out_fp, (2, ind[0], ind[1])), valid, 4, tol)
+      del out_fp
+      parallel(delayed(parallel_windows)(mfile, shape, kfine[k:k+nbatch], maxscale, notes, win, shift, density, outfile) for k in xrange(0, len(kfine), nbatch))
+      print "%s windows computed, the rest interpolated" % (str(len(kvalid)+len(kfine)))
+
+   out_fp = np.memmap(outfile, dtype='float64', mode='r', shape=(2, nwin))
+   SRT = np.reshape(out_fp[0]+out_fp[1], ind)
+   del out_fp
+   return SRT
+
+# =========================================================
+def parallel_windows(mfile, shape, k, maxscale, notes, win, shift, density, outfile=None):
+   '''
+   lengthscales of windows k (window numbers) of the merged echogram in 
+   memory-mapped file mfile, sliced here in the worker, as a (2, len(k))
+   array (windows, then transposed windows). If outfile is given they
+   are written into columns k of that (2, number of windows) 
+   memory-mapped file instead of being returned
+   '''
+   merge_fp = np.memmap(mfile, dtype='float32', mode='r', shape=shape)
+   Z = humutils.window_batch(merge_fp, (win,win), (shift,shift), k)
+   del merge_fp
+   d = cwt.cwt_var2(Z, maxscale, notes, win, density)
+   if outfile is None:
+      return d
+   ind = humutils.window_grid(shape, (win,win), (shift,shift))
+   out_fp = np.memmap(outfile, dtype='float64', mode='r+', shape=(2, ind[0]*ind[1]))
+   out_fp[:, k] = d
+   del out_fp
+
+# =========================================================
+def coarse_nodes(n, step):
+   '''
+   every step-th of n grid nodes, and the last
+   '''
+   return np.unique(np.r_[0:n:step, n-1])
+
+# =========================================================
+def adaptive_refine(S, valid, step, tol):
+   '''
+   coarse to fine sampling. S is a (2, ny, nx) array of lengthscales (both
+   orientations) known at the coarse_nodes(., step) of each axis. In each
+   coarse cell whose 4 corners (the sum of both orientations) differ by
+   more than tol times their mean, or are not all known, the windows
+   (where valid) are returned to be computed. In the other cells S is 
+   filled, in place, by bilinear interpolation of the corners
+   '''
+   ny, nx = np.shape(valid)
+   I = coarse_nodes(ny, step)
+   J = coarse_nodes(nx, step)
+   refine = np.zeros((ny, nx), bool)
+   for a in xrange(len(I)-1):
+      for b in xrange(len(J)-1):
+         i0, i1, j0, j1 = I[a], I[a+1], J[b], J[b+1]
+         c = S[:, [i0,i0,i1,i1], [j0,j1,j0,j1]]
+         csum = c.sum(axis=0)
+         if np.any(np.isnan(csum)) or (csum.max()-csum.min()) > tol*np.abs(csum.mean()):
+            refine[i0:i1+1, j0:j1+1] = True
+         else:
+            y = ((np.arange(i0,i1+1)-i0)/float(i1-i0))[:,None]
+            x = ((np.arange(j0,j1+1)-j0)/float(j1-j0))[None,:]
+            for o in [0,1]:
+               S[o, i0:i1+1, j0:j1+1] = np.where(valid[i0:i1+1, j0:j1+1], c[o,0]*(1-y)*(1-x) + c[o,1]*(1-y)*x + c[o,2]*y*(1-x) + c[o,3]*y*x, np.nan)
+   refine[np.ix_(I, J)] = False
+   return np.flatnonzero(refine & valid)
+
+# =========================================================
+def batchsize(win, maxscale, notes, density, maxbytes=2**26):
+   '''
+   number of windows to transform together in cwt.cwt_var, such that
+   the complex wavelet coefficients of one scale of a batch, in both
+   orientations, take about maxbytes (cwt_var2 holds one scale at a
+   time, whatever notes is)
+   '''
+   ndata = 2**(np.floor(np.log(win)/np.log(2) + 0.4999)+1)
+   ncols = len(np.arange(1,win-1,density))
+   return int(max(maxbytes//(32*ndata*max(ncols,1)), 1))
+
+# =========================================================
+def plot_class(dist_m, shape_port, dat_port, dat_star, dat_class, ft, humfile, sonpath, base, p, clim=(None, None)):
 
    Zdist = dist_m[shape_port[-1]*p:shape_port[-1]*(p+1)]
    extent = shape_port[1]
@@ -420,7 +805,7 @@ def plot_class(dist_m, shape_port, dat_port, dat_star, dat_class, ft, humfile, s
    fig.subplots_adjust(wspace = 0, hspace=0.075)
    plt.subplot(2,1,1)
    ax = plt.gca()
-   im = ax.imshow(np.vstack((np.flipud(dat_port),dat_star)) ,cmap='gray',extent=[min(Zdist), max(Zdist), -extent*(1/ft), extent*(1/ft)],origin='upper')
+   im = ax.imshow(np.vstack((np.flipud(dat_port),dat_star)) ,cmap='gray',vmin=clim[0],vmax=clim[1],extent=[min(Zdist), max(Zdist), -extent*(1/ft), extent*(1/ft)],origin='upper')
    plt.ylabel('Horizontal distance (m)'); 
    plt.axis('tight')
 
@@ -439,7 +824,7 @@ def plot_class(dist_m, shape_port, dat_port, dat_star, dat_class, ft, humfile, s
 
    plt.subplot(2,1,2)
    ax = plt.gca()
-   plt.imshow(np.vstack((np.flipud(dat_port), dat_star)),cmap='gray',extent=[min(Zdist), max(Zdist), -extent*(1/ft), extent*(1/ft)],origin='upper')
+   plt.imshow(np.vstack((np.flipud(dat_port), dat_star)),cmap='gray',vmin=clim[0],vmax=clim[1],extent=[min(Zdist), max(Zdist), -extent*(1/ft), extent*(1/ft)],origin='upper')
    im = ax.imshow(dat_class, alpha=0.5,extent=[min(Zdist), max(Zdist), -extent*(1/ft), extent*(1/ft)],origin='upper', cmap='YlOrRd', vmin=0.5, vmax=3)
    plt.ylabel('Horizontal distance (m)'); 
    plt.xlabel('Distance along track (m)')
@@ -482,7 +867,7 @@ def plot_contours(dist_m, shape_port, dat_class, ft, humfile, sonpath, base, num
    del CS, levels
 
 # =========================================================
-def plot_kmeans(dist_m, shape_port, dat_port, dat_star, dat_kclass, ft, humfile, sonpath, base, p):
+def plot_kmeans(dist_m, shape_port, dat_port, dat_star, dat_kclass, ft, humfile, sonpath, base, p, clim=(None, None)):
 
    Zdist = dist_m[shape_port[-1]*p:shape_port[-1]*(p+1)]
    extent = shape_port[1] 
@@ -492,7 +877,7 @@ def plot_kmeans(dist_m, shape_port, dat_port, dat_star, dat_kclass, ft, humfile,
    fig = plt.figure()
    plt.subplot(2,1,1)
    ax = plt.gca()
-   plt.imshow(np.vstack((np.flipud(dat_port), dat_star)), cmap='gray',extent=[min(Zdist), max(Zdist), -extent*(1/ft), extent*(1/ft)],origin='upper')
+   plt.imshow(np.vstack((np.flipud(dat_port), dat_star)), cmap='gray',vmin=clim[0],vmax=clim[1],extent=[min(Zdist), max(Zdist), -extent*(1/ft), extent*(1/ft)],origin='upper')
    
    CS = plt.contourf(np.flipud(dat_kclass), levels, alpha=0.4, extent=[min(Zdist), max(Zdist), -extent*(1/ft), extent*(1/ft)],origin='upper', cmap='YlOrRd', vmin=0.5, vmax=3)   
    plt.ylabel('Horizontal distance (m)')
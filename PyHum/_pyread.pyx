@@ -26,11 +26,55 @@ from __future__ import generators
 from __future__ import division
 import numpy as np
 cimport numpy as np
+cimport cython
 from libc.math cimport tan, atan, exp
 
 from array import array as arr
 import pyproj
-import os, struct
+import struct
+
+# =========================================================
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef Py_ssize_t _match(unsigned char[::1] buf, unsigned char[::1] pattern, np.intp_t[::1] starts) nogil:
+    """
+    the number of copies of pattern in buf, and (if starts has room for
+    them) their start positions, in order. Copies cannot overlap, as the
+    packet start sequence does not overlap itself
+    """
+    cdef Py_ssize_t n = buf.shape[0], m = pattern.shape[0]
+    cdef Py_ssize_t i = 0, k, count = 0
+    if m == 0:
+       return 0
+    while i <= n-m:
+       k = 0
+       while k < m and buf[i+k] == pattern[k]:
+          k += 1
+       if k == m:
+          if count < starts.shape[0]:
+             starts[count] = i
+          count += 1
+          i += m
+       else:
+          i += 1
+    return count
+
+# =========================================================
+def find_packets(np.ndarray buf, pattern):
+    """
+    start positions of the copies of the byte sequence pattern in buf, a
+    uint8 array (e.g. a whole .SON file). The search does not hold the GIL
+    """
+    cdef unsigned char[::1] b = np.ascontiguousarray(buf, np.uint8)
+    cdef unsigned char[::1] p = np.asarray(pattern, np.uint8)
+    cdef np.intp_t[::1] starts = np.empty(0, np.intp)
+    cdef Py_ssize_t count
+    with nogil:
+       count = _match(b, p, starts)
+    starts = np.empty(count, np.intp)
+    with nogil:
+       _match(b, p, starts)
+    return np.asarray(starts)
 
 # =========================================================
 cdef class pyread:
@@ -68,12 +112,8 @@ cdef class pyread:
        humdat = self._decode_humdat(fid2, trans) #, transWGS84)
        self.humdat = humdat
 
-       cdef list dat = []       
        cdef list data = [] 
        cdef list dfbreak = []  
-       cdef list ints_list = []   
-       cdef list int_list = [] 
-       cdef list fbreak=[]
        cdef list tmpdata = [] 
               
        for sonfile in sonfiles:
@@ -91,13 +131,11 @@ cdef class pyread:
              idxfid.close()
              dfbreak = np.diff(dfbreak).tolist()
 
+             buf = np.fromfile(sonfile, np.uint8)
              fid = open(sonfile,'rb')
              for i from 0 <= i < len(dfbreak):       
                 tmpdata.append(self._gethead(fid,trans,c, humdat['linesize']))
-                ints_list = []
-                for j from 0 <= j < dfbreak[i]-headbytes:                 
-                   ints_list.append(struct.unpack('>B', ''.join(self._fread(fid,1,'c')) )[0])
-                tmpdata.append(ints_list) # grab the sonar data     
+                tmpdata.append(self._getpacket(fid, buf, dfbreak[i]-headbytes)) # grab the sonar data     
              dfbreak = [] 
              data.append(tmpdata)  
              tmpdata = []   
@@ -105,30 +143,16 @@ cdef class pyread:
              fid.close()
 
           except: #if idx is absent, or empty, or if son files are corrupted
-             fid = open(sonfile,'rb')
-             dat = self._fread(fid,os.path.getsize(sonfile), 'c')
-             fid.close()
-
-             # unpack into integers
-             for i from 0 <= i < len(dat):
-                int_list.append(struct.unpack('>B', dat[i])[0])
-             dat = [] 
+             # the whole file as bytes
+             buf = np.fromfile(sonfile, np.uint8)
 
-             # find the start sequences in the list of integers
-             for s in self._KnuthMorrisPratt(int_list, [192,222,171,33,128]): 
-                fbreak.append(s)
-             int_list = [] 
-          
-             dfbreak = [ x-y for (x,y) in zip(fbreak[1:],fbreak[:-1]) ]
-             fbreak = []
+             # find the start sequences in the bytes
+             dfbreak = np.diff(find_packets(buf, [192,222,171,33,128])).tolist()
      
              fid = open(sonfile,'rb')
              for i from 0 <= i < len(dfbreak):              
                 tmpdata.append(self._gethead(fid,trans, c, model, humdat['linesize'])) # get header for packet transWGS84,
-                ints_list = []
-                for j from 0 <= j < dfbreak[i]-headbytes:                 
-                   ints_list.append(struct.unpack('>B', ''.join(self._fread(fid,1,'c')) )[0])
-                tmpdata.append(ints_list) # grab the sonar data     
+                tmpdata.append(self._getpacket(fid, buf, dfbreak[i]-headbytes)) # grab the sonar data     
              dfbreak = [] 
              data.append(tmpdata)  
              tmpdata = []   
@@ -150,37 +174,16 @@ cdef class pyread:
        return (xfinal, yfinal)
 
     # =========================================================
-    def _KnuthMorrisPratt(self, list text, list pattern):
-       # Knuth-Morris-Pratt string matching
-       # David Eppstein, UC Irvine, 1 Mar 2002
-       # http://code.activestate.com/recipes/117214/
-
-       '''Yields all starting positions of copies of the pattern in the text.
-       Calling conventions are similar to string.find, but its arguments can be
-       lists or iterators, not just strings, it returns all matches, not just
-       the first one, and it does not need the whole text in memory at once. 
-       Whenever it yields, it will have read the text exactly up to and including
-       the match that caused the yield.'''
-
-       # build table of shift amounts
-       cdef list shifts = [1] * (len(pattern) + 1)
-       cdef int shift = 1
-       for pos from 0 <= pos < len(pattern):       
-          while shift <= pos and pattern[pos] != pattern[pos-shift]:
-             shift += shifts[pos-shift]
-          shifts[pos+1] = shift
-
-       # do the actual search
-       cdef int startPos = 0
-       cdef int matchLen = 0
-       for c in text:
-          while matchLen == len(pattern) or \
-                matchLen >= 0 and pattern[matchLen] != c:
-              startPos += shifts[matchLen]
-              matchLen -= shifts[matchLen]
-          matchLen += 1
-          if matchLen == len(pattern):
-             yield startPos
+    def _getpacket(self, fid, np.ndarray buf, int num):
+       '''
+       the num bytes of sonar data at the current position of fid, taken
+       from buf (the whole file) as a list of ints, moving fid past them
+       '''
+       cdef long pos = fid.tell()
+       if pos+num > len(buf):
+          raise EOFError('packet runs past the end of the file')
+       fid.seek(num, 1)
+       return buf[pos:pos+num].tolist()
 
     # =========================================================
     def _fread(self, infile, int num, str typ):
@@ -25,6 +25,9 @@ http://www.usgs.gov/visual-id/credit_usgs.html#copyright
 from __future__ import division
 import numpy as np
 cimport numpy as np
+cimport cython
+from libc.math cimport NAN
+from scipy.ndimage import distance_transform_edt
 
 # =========================================================
 cdef class RN:
@@ -60,98 +63,8 @@ cdef class RN:
     a copy of the input array, where NaN elements have been replaced.
     """
      
-    cdef int i, j, I, J, it, k, l
-    cdef int n_invalids 
-    cdef double n
-    
-    cdef np.ndarray[np.float64_t, ndim=2] filled = np.empty( [array.shape[0], array.shape[1]], dtype=np.float64)
-    cdef np.ndarray[np.float64_t, ndim=2] kernel = np.empty( (2*kernel_size+1, 2*kernel_size+1), dtype=np.float64)
-
-    cdef np.ndarray[np.int64_t, ndim=1] inans = np.empty( [array.shape[0]], dtype=np.int64)
-    cdef np.ndarray[np.int64_t, ndim=1] jnans = np.empty( [array.shape[1]], dtype=np.int64)
-
-    # indices where array is NaN
-    inans, jnans = np.nonzero( np.isnan(array) )
-    
-    # number of NaN elements
-    cdef int n_nans 
-    n_nans = len(inans)
-    
-    # arrays which contain replaced values to check for convergence
-    cdef np.ndarray[np.float64_t, ndim=1] replaced_new = np.zeros( n_nans, dtype=np.float64)
-    cdef np.ndarray[np.float64_t, ndim=1] replaced_old = np.zeros( n_nans, dtype=np.float64)
-    
-    # depending on kernel type, fill kernel array
-    if method == 'localmean':
-      
-        #print 'kernel_size', kernel_size       
-        for i in range(2*kernel_size+1):
-            for j in range(2*kernel_size+1):
-                kernel[i,j] = 1
-        #print kernel, 'kernel'
-
-    elif method == 'idw':
-        kernel = np.array([[0, 0.5, 0.5, 0.5,0],
-                  [0.5,0.75,0.75,0.75,0.5], 
-                  [0.5,0.75,1,0.75,0.5],
-                  [0.5,0.75,0.75,0.5,1],
-                  [0, 0.5, 0.5 ,0.5 ,0]])
-        #print kernel, 'kernel'      
-    else:
-        raise ValueError( 'method not valid. Should be one of `localmean`.')
-    
-    filled = array.copy()
-
-    # make several passes
-    # until we reach convergence
-    #for it in xrange(max_iter):
-    for it from 0 <= it < max_iter:  
-        #print 'iteration', it
-        # for each NaN element
-        #for k in xrange(n_nans):
-        for k from 0 <= k < n_nans:  
-            i = inans[k]
-            j = jnans[k]
-            
-            # initialize to zero
-            filled[i,j] = 0.0
-            n = 0.0
-            
-            # loop over the kernel
-            #for I in xrange(2*kernel_size+1):
-            for I from 0 <= I < 2*kernel_size+1:  
-                #for J in xrange(2*kernel_size+1):
-                for J from 0 <= J < 2*kernel_size+1:                     
-                    # if we are not out of the boundaries
-                    if i+I-kernel_size < array.shape[0] and i+I-kernel_size >= 0:
-                        if j+J-kernel_size < array.shape[1] and j+J-kernel_size >= 0:
-                                                
-                            # if the neighbour element is not NaN itself.
-                            if filled[i+I-kernel_size, j+J-kernel_size] == filled[i+I-kernel_size, j+J-kernel_size] :
-                                
-                                # do not sum itself
-                                if I-kernel_size != 0 and J-kernel_size != 0:
-                                    
-                                    # convolve kernel with original array
-                                    filled[i,j] = filled[i,j] + filled[i+I-kernel_size, j+J-kernel_size]*kernel[I, J]
-                                    n = n + 1*kernel[I,J]
-                                    #print n
-
-            # divide value by effective number of added elements
-            if n != 0:
-                filled[i,j] = filled[i,j] / n
-                replaced_new[k] = filled[i,j]
-            else:
-                filled[i,j] = np.nan
-                
-        # check if mean square difference between values of replaced
-        #elements is below a certain tolerance
-        #print 'tolerance', np.mean( (replaced_new-replaced_old)**2 )
-        if np.mean( (replaced_new-replaced_old)**2 ) < tol:
-            break
-        else:
-            for l in xrange(n_nans):
-                replaced_old[l] = replaced_new[l]
+    # the typed kernel of inpaint does the iterations
+    filled = inpaint(array, 'iterative', kernel_size, method, max_iter, tol)
     
     self.data = filled
     return #filled
@@ -162,3 +75,236 @@ cdef class RN:
        
        
     
+# =========================================================
+_idw = np.array([[0, 0.5, 0.5, 0.5,0],
+                 [0.5,0.75,0.75,0.75,0.5], 
+                 [0.5,0.75,1,0.75,0.5],
+                 [0.5,0.75,0.75,0.5,1],
+                 [0, 0.5, 0.5 ,0.5 ,0]])
+
+# =========================================================
+def inpaint(np.ndarray array, str method='frontier', int kernel_size=1, str kernel='localmean', int max_iter=10, double tol=0.01):
+    """
+    Replace NaN elements in an array, in near linear time
+
+    Parameters
+    ----------
+    array : 2d np.ndarray
+    an array containing NaN elements that have to be replaced
+    method : str
+    `frontier` (default): the NaNs next to valid elements are filled, then 
+    those next to them, and so on, each once, with the weighted mean of the
+    valid neighbours. `nearest`: each NaN takes the value of the nearest
+    valid element (exact Euclidean distance transform). `pyramid`: NaNs are
+    filled from successively coarser (2x2 NaN-aware mean) copies of the 
+    array. `iterative`: the algorithm of RN.
+    After the first fill, up to max_iter sweeps of the RN averaging are made
+    over the NaN elements, until the mean square change is below tol
+    kernel_size : int
+    the size of the kernel, default is 1
+    kernel : str
+    `localmean` or 'idw' neighbour weights, as in RN
+    max_iter : int
+    maximum number of smoothing sweeps (iterations for `iterative`)
+    tol : float
+    convergence tolerance of the sweeps
+
+    Returns
+    -------
+    filled : 2d np.ndarray
+    a float64 copy of the input array, where NaN elements have been replaced
+    (those with no valid element within reach remain NaN)
+    """
+    cdef np.ndarray[np.float64_t, ndim=2] filled = np.array(array, dtype=np.float64, order='C')
+    cdef np.ndarray[np.float64_t, ndim=2] w = _kernel(kernel_size, kernel)
+    mask = np.isnan(filled)
+    if not mask.any():
+       return filled
+    inans, jnans = [np.ascontiguousarray(k, dtype=np.intp) for k in np.nonzero(mask)]
+
+    if method == 'frontier':
+       _frontier(filled, inans, jnans, w, kernel_size)
+    elif method == 'nearest':
+       if mask.all():
+          return filled
+       ind = distance_transform_edt(mask, return_distances=False, return_indices=True)
+       filled = filled[ind[0], ind[1]]
+    elif method == 'pyramid':
+       filled = _pyramid(filled, w, kernel_size, max_iter, tol)
+    elif method != 'iterative':
+       raise ValueError( 'method not valid. Should be one of `frontier`, `nearest`, `pyramid`, `iterative`.')
+
+    _relax(filled, inans, jnans, w, kernel_size, max_iter, tol)
+    return filled
+
+# =========================================================
+cdef np.ndarray _kernel(int kernel_size, str kernel):
+    """
+    neighbour weights of RN
+    """
+    if kernel == 'localmean':
+       return np.ones((2*kernel_size+1, 2*kernel_size+1), dtype=np.float64)
+    elif kernel == 'idw':
+       if kernel_size > 2:
+          raise ValueError( 'kernel_size should be at most 2 for `idw`.')
+       return np.ascontiguousarray(_idw[:2*kernel_size+1, :2*kernel_size+1], dtype=np.float64)
+    else:
+       raise ValueError( 'kernel not valid. Should be one of `localmean`, `idw`.')
+
+# =========================================================
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline double _wmean(double[:, ::1] a, Py_ssize_t i, Py_ssize_t j, double[:, ::1] w, int ks) nogil:
+    """
+    weighted mean of the valid neighbours of a[i,j], with the neighbourhood
+    of RN (the row and column through i,j are excluded). NaN if there are none
+    """
+    cdef Py_ssize_t I, J, ii, jj
+    cdef double s = 0.0, n = 0.0, v
+    for I in range(2*ks+1):
+       ii = i+I-ks
+       if I == ks or ii < 0 or ii >= a.shape[0]:
+          continue
+       for J in range(2*ks+1):
+          jj = j+J-ks
+          if J == ks or jj < 0 or jj >= a.shape[1]:
+             continue
+          v = a[ii,jj]
+          if v == v:
+             s = s + v*w[I,J]
+             n = n + w[I,J]
+    if n != 0:
+       return s/n
+    return NAN
+
+# =========================================================
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _relax(double[:, ::1] a, Py_ssize_t[::1] inans, Py_ssize_t[::1] jnans, double[:, ::1] w, int ks, int max_iter, double tol):
+    """
+    RN iterations (in place) over the elements inans, jnans of a 
+    """
+    cdef Py_ssize_t k, n_nans = inans.shape[0]
+    cdef int it
+    cdef double v, d, err
+    cdef double[::1] replaced = np.zeros(n_nans, dtype=np.float64)
+    for k in range(n_nans):
+       v = a[inans[k], jnans[k]]
+       if v == v:
+          replaced[k] = v
+    with nogil:
+       for it in range(max_iter):
+          err = 0.0
+          for k in range(n_nans):
+             v = _wmean(a, inans[k], jnans[k], w, ks)
+             a[inans[k], jnans[k]] = v
+             if v == v:
+                d = v - replaced[k]
+                err = err + d*d
+                replaced[k] = v
+          if n_nans == 0 or err/n_nans < tol:
+             break
+
+# =========================================================
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _frontier(double[:, ::1] a, Py_ssize_t[::1] inans, Py_ssize_t[::1] jnans, double[:, ::1] w, int ks):
+    """
+    fill the NaN elements inans, jnans of a (in place) in layers outwards from 
+    the valid elements. Each layer is computed from the elements valid
+    before it, so every element is visited once and the result does not 
+    depend on the order of the elements
+    """
+    cdef Py_ssize_t n_nans = inans.shape[0]
+    cdef Py_ssize_t nr = a.shape[0], nc = a.shape[1]
+    cdef Py_ssize_t k, q, head = 0, tail = 0, end, ii, jj, I, J
+    cdef double v
+    cdef Py_ssize_t[::1] qi = np.empty(n_nans, dtype=np.intp)
+    cdef Py_ssize_t[::1] qj = np.empty(n_nans, dtype=np.intp)
+    cdef double[::1] vals = np.empty(n_nans, dtype=np.float64)
+    # 1 = NaN and not queued
+    cdef unsigned char[:, ::1] state = np.zeros((nr, nc), dtype=np.uint8)
+
+    with nogil:
+       for k in range(n_nans):
+          state[inans[k], jnans[k]] = 1
+       # first layer: NaNs with a valid neighbour
+       for k in range(n_nans):
+          v = _wmean(a, inans[k], jnans[k], w, ks)
+          if v == v:
+             qi[tail] = inans[k]
+             qj[tail] = jnans[k]
+             state[inans[k], jnans[k]] = 2
+             tail = tail + 1
+
+       while head < tail:
+          end = tail
+          for q in range(head, end):
+             vals[q] = _wmean(a, qi[q], qj[q], w, ks)
+          for q in range(head, end):
+             a[qi[q], qj[q]] = vals[q]
+          # NaNs that have a just filled element as neighbour are next
+          for q in range(head, end):
+             for I in range(2*ks+1):
+                if I == ks:
+                   continue
+                for J in range(2*ks+1):
+                   if J == ks or w[I,J] == 0:
+                      continue
+                   ii = qi[q]-(I-ks)
+                   jj = qj[q]-(J-ks)
+                   if ii >= 0 and ii < nr and jj >= 0 and jj < nc:
+                      if state[ii,jj] == 1:
+                         state[ii,jj] = 2
+                         qi[tail] = ii
+                         qj[tail] = jj
+                         tail = tail + 1
+          head = end
+
+# =========================================================
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef np.ndarray _pyramid(np.ndarray[np.float64_t, ndim=2] a, double[:, ::1] w, int ks, int max_iter, double tol):
+    """
+    fill the NaNs of a from a 2x2 NaN-aware mean of a, itself filled the
+    same way, then smooth them at this level
+    """
+    cdef Py_ssize_t nr = a.shape[0], nc = a.shape[1]
+    cdef Py_ssize_t i, j
+    cdef np.ndarray[np.float64_t, ndim=2] s = np.zeros(((nr+1)//2, (nc+1)//2), dtype=np.float64)
+    cdef np.ndarray[np.float64_t, ndim=2] n = np.zeros(((nr+1)//2, (nc+1)//2), dtype=np.float64)
+    cdef double[:, ::1] av = a
+    cdef double[:, ::1] sv = s
+    cdef double[:, ::1] nv = n
+
+    mask = np.isnan(a)
+    if not mask.any() or mask.all():
+       return a
+    if nr == 1 and nc == 1:
+       return a
+
+    with nogil:
+       for i in range(nr):
+          for j in range(nc):
+             if av[i,j] == av[i,j]:
+                sv[i//2, j//2] = sv[i//2, j//2] + av[i,j]
+                nv[i//2, j//2] = nv[i//2, j//2] + 1.0
+       for i in range(sv.shape[0]):
+          for j in range(sv.shape[1]):
+             if nv[i,j] > 0:
+                sv[i,j] = sv[i,j]/nv[i,j]
+             else:
+                sv[i,j] = NAN
+
+    s = _pyramid(s, w, ks, max_iter, tol)
+    sv = s
+    with nogil:
+       for i in range(nr):
+          for j in range(nc):
+             if av[i,j] != av[i,j]:
+                av[i,j] = sv[i//2, j//2]
+
+    inans, jnans = [np.ascontiguousarray(k, dtype=np.intp) for k in np.nonzero(mask)]
+    _relax(a, inans, jnans, w, ks, max_iter, tol)
+    return a
+
@@ -24,9 +24,32 @@ from __future__ import division
 import numpy as np
 cimport numpy as np
 cimport cython
+from libc.math cimport sqrt, pow
 
 #from pylab import fft2, ifft2, fftshift, real
-from scipy.interpolate import RectBivariateSpline
+import PyHum.utils as humutils
+
+# =========================================================
+@cython.boundscheck(False)
+@cython.cdivision(True)
+@cython.wraparound(False)
+cdef void _powerlaw(double complex[:, ::1] spec, double factor) nogil:
+   """
+   the (shifted) spectrum spec, in place, replaced by its phase over the
+   distance from its [0,0] element to the power factor. The distance is
+   taken as 1 at [0,0] and at [cols/2+1, rows/2+1]
+   """
+   cdef Py_ssize_t i, j
+   cdef Py_ssize_t ic = spec.shape[0]//2 + 1, jc = spec.shape[1]//2 + 1
+   cdef double radius, mag
+   for i in range(spec.shape[0]):
+      for j in range(spec.shape[1]):
+         if (i == 0 and j == 0) or (i == ic and j == jc):
+            radius = 1
+         else:
+            radius = sqrt(<double>(i*i + j*j))
+         mag = sqrt(spec[i,j].real*spec[i,j].real + spec[i,j].imag*spec[i,j].imag)
+         spec[i,j] = spec[i,j]/(mag*pow(radius, factor))
 
 # =========================================================
 cdef class Noise:
@@ -44,27 +67,17 @@ cdef class Noise:
 
       cdef np.ndarray[np.float64_t, ndim=2] res = np.empty( (rows, cols), dtype=np.float64)
       cdef np.ndarray[np.float64_t, ndim=2] noise = np.empty( (rows, cols), dtype=np.float64)
-      cdef np.ndarray[np.float64_t, ndim=2] filt = np.empty( (rows, cols), dtype=np.float64)
-      cdef np.ndarray[np.float64_t, ndim=2] radius = np.empty( (rows, cols), dtype=np.float64)
-      cdef np.ndarray[np.float64_t, ndim=2] mag = np.empty( (rows, cols), dtype=np.float64)
       cdef np.ndarray[np.float64_t, ndim=2] rr = np.empty( (rows, cols), dtype=np.float64)
       cdef np.ndarray[np.complex128_t, ndim=2] ffrr = np.empty( (rows, cols), dtype=np.complex128)
       cdef np.ndarray[np.complex128_t, ndim=2] imfft = np.empty( (rows, cols), dtype=np.complex128)
-      cdef np.ndarray[np.complex128_t, ndim=2] phase = np.empty( (rows, cols), dtype=np.complex128)
-      cdef np.ndarray[np.int64_t, ndim=2] xi = np.empty((rows,cols),dtype=np.int64)
-      cdef np.ndarray[np.int64_t, ndim=2] yi = np.empty((rows,cols),dtype=np.int64)
 
       rr = np.random.randn(cols,rows)
       ffrr = np.fft.fft2(rr)
       imfft = np.fft.fftshift(ffrr)
-      mag = np.abs(imfft)  
-      phase = imfft/mag  
-      xi, yi = np.meshgrid(np.r_[:rows].astype('int64'),np.r_[:cols].astype('int64'))  
-      radius = np.sqrt(xi**2 + yi**2)
-      radius[int(cols/2 + 1), int(rows/2 + 1)] = 1
-      radius[radius==0] = 1
-      filt = np.divide(1,(radius**factor))
-      noise = np.real(np.fft.ifft2(np.fft.fftshift(np.multiply(filt,phase)))) 
+      cdef double complex[:, ::1] spec = imfft
+      with nogil:
+         _powerlaw(spec, factor)
+      noise = np.real(np.fft.ifft2(np.fft.fftshift(imfft))) 
       noise = noise/noise.sum() 
       res = self._rescale(self._im_resize(noise[::2,::2],cols,rows),np.nanmin(im),np.nanmax(im))
       self.res = np.asarray(res,'float16').T
@@ -90,15 +103,9 @@ cdef class Noise:
    @cython.nonecheck(False)
    cpdef np.ndarray _im_resize(self, np.ndarray im, int Nx, int Ny):
       '''
-      resize array by bivariate spline interpolation
+      resize array by separable bicubic interpolation (see humutils.im_resize)
       '''
-      cdef int nx
-      cdef int ny
-      ny, nx = np.shape(im)
-      cdef np.ndarray xx = np.linspace(0,nx,Nx)
-      cdef np.ndarray yy = np.linspace(0,ny,Ny)
-      cdef object newKernel = RectBivariateSpline(np.r_[:ny],np.r_[:nx],im) 
-      return newKernel(yy,xx)
+      return humutils.im_resize(im,Nx,Ny,'bicubic',np.empty((Ny,Nx),dtype=np.float64))
 
    # =========================================================
    cpdef np.ndarray getres(self):
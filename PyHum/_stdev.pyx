@@ -45,9 +45,8 @@ cdef class proc:
       cdef list filled
 
       rs1 = RunningStats.RunningStats()
-      # global stats, not detrended
-      for k in points:
-         rs1.Push(k)
+      # global stats, not detrended (all values pushed at once)
+      rs1.PushBuffer(np.ascontiguousarray(points, dtype=np.float64))
  
       # compile all parameters into a list
       filled = [rs1.Mean(), rs1.StandardDeviation()]
@@ -66,4 +65,32 @@ cdef class proc:
    cpdef list getdata(self):
       return self.data
 
+# =========================================================
+def summary(np.ndarray points):
+   """
+   RunningStats summary (number of values, mean, and 2nd to 4th central 
+   moment sums) of points, as a float64 array of 5. Summaries of parts of
+   the data (e.g. windows or chunks, computed in parallel) are reduced 
+   with combine
+   """
+   cdef np.ndarray[np.float64_t, ndim=1] out = np.zeros(5, dtype=np.float64)
+   rs1 = RunningStats.RunningStats()
+   rs1.PushBuffer(np.ascontiguousarray(points, dtype=np.float64).ravel())
+   rs1.SummaryBuffer(out)
+   return out
 
+# =========================================================
+def combine(summaries):
+   """
+   summary of all the data of a sequence of summaries (see summary), by
+   merging their RunningStats (Chan et al.). Returns the summary, and the
+   mean and standard deviation
+   """
+   cdef np.ndarray[np.float64_t, ndim=1] out = np.zeros(5, dtype=np.float64)
+   rs1 = RunningStats.RunningStats()
+   for k in summaries:
+      rs2 = RunningStats.RunningStats()
+      rs2.LoadBuffer(np.ascontiguousarray(k, dtype=np.float64))
+      rs1.Merge(rs2)
+   rs1.SummaryBuffer(out)
+   return out, [rs1.Mean(), rs1.StandardDeviation()]
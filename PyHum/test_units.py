@@ -0,0 +1,301 @@
+## PyHum (Python program for Humminbird(R) data processing)
+## has been developed at the Grand Canyon Monitoring & Research Center,
+## U.S. Geological Survey
+##
+## Author: Daniel Buscombe
+## Project homepage: <https://github.com/dbuscombe-usgs/PyHum>
+##
+##This software is in the public domain because it contains materials that originally came from
+##the United States Geological Survey, an agency of the United States Department of Interior.
+##For more information, see the official USGS copyright policy at
+##http://www.usgs.gov/visual-id/credit_usgs.html#copyright
+##
+## This program is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+## See the GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# checks of the compiled kernels and utils helpers against the original
+# (pure python) implementations or scipy. Run with
+#python -m PyHum.test_units
+# or with pytest
+
+import numpy as np
+from scipy.ndimage import median_filter as sp_median_filter
+from scipy.ndimage import map_coordinates, gaussian_filter
+
+from PyHum import median, replace_nans, pyread, cwt, ppdrc, stdev
+import PyHum.utils as humutils
+
+__all__ = ['dotest']
+
+# =========================================================
+def _rn_reference(array, max_iter, tol, kernel_size=1, kernel='localmean'):
+   '''
+   the original RN inpainting loop, in python
+   '''
+   if kernel == 'localmean':
+      w = np.ones((2*kernel_size+1, 2*kernel_size+1))
+   else:
+      w = np.array([[0, 0.5, 0.5, 0.5,0],
+                    [0.5,0.75,0.75,0.75,0.5],
+                    [0.5,0.75,1,0.75,0.5],
+                    [0.5,0.75,0.75,0.5,1],
+                    [0, 0.5, 0.5 ,0.5 ,0]])
+   filled = array.copy()
+   inans, jnans = np.nonzero(np.isnan(array))
+   replaced_new = np.zeros(len(inans))
+   replaced_old = np.zeros(len(inans))
+   for it in xrange(max_iter):
+      for k in xrange(len(inans)):
+         i, j = inans[k], jnans[k]
+         filled[i,j] = 0.0
+         n = 0.0
+         for I in xrange(2*kernel_size+1):
+            for J in xrange(2*kernel_size+1):
+               ii, jj = i+I-kernel_size, j+J-kernel_size
+               if 0 <= ii < array.shape[0] and 0 <= jj < array.shape[1]:
+                  if filled[ii,jj] == filled[ii,jj]:
+                     if I-kernel_size != 0 and J-kernel_size != 0:
+                        filled[i,j] += filled[ii,jj]*w[I,J]
+                        n += w[I,J]
+         if n != 0:
+            filled[i,j] = filled[i,j]/n
+            replaced_new[k] = filled[i,j]
+         else:
+            filled[i,j] = np.nan
+      if np.mean((replaced_new-replaced_old)**2) < tol:
+         break
+      replaced_old[:] = replaced_new
+   return filled
+
+# =========================================================
+def _holes(shape, seed=0):
+   '''
+   a smooth random field with NaN holes (some several pixels across)
+   '''
+   rng = np.random.RandomState(seed)
+   a = np.cumsum(np.cumsum(rng.randn(*shape), axis=0), axis=1)
+   a[rng.rand(*shape) < 0.1] = np.nan
+   a[5:9, 10:16] = np.nan
+   return a
+
+# =========================================================
+def test_median_filter():
+   rng = np.random.RandomState(0)
+   a = rng.randn(60, 45)*10
+   width = (a.max()-a.min())/256
+   for size in [1, 3, (5, 9), 11]:
+      out = median.median_filter(a, size)
+      ref = sp_median_filter(a, size=size, mode='reflect')
+      assert np.abs(out-ref).max() <= width
+
+# =========================================================
+def test_median_filter_nan():
+   a = np.arange(25.0).reshape(5, 5)
+   a[2, 2] = np.nan
+   out = median.median_filter(a, 3, nbins=1000)
+   # the centre window holds 8 valid values: the upper of the middle two
+   # (13) is taken, as scipy.ndimage.median_filter does for even sizes
+   assert abs(out[2, 2]-13) <= 24/1000.0
+   assert np.isnan(median.median_filter(np.nan*a, 3)).all()
+
+# =========================================================
+def test_inpaint_iterative():
+   a = _holes((30, 40))
+   for ks, kernel in [(1, 'localmean'), (2, 'localmean'), (2, 'idw')]:
+      ref = _rn_reference(a, 10, 0.01, ks, kernel)
+      assert np.allclose(replace_nans.inpaint(a, 'iterative', ks, kernel, 10, 0.01), ref, equal_nan=True)
+      assert np.allclose(replace_nans.RN(a, 10, 0.01, ks, kernel).getdata(), ref, equal_nan=True)
+
+# =========================================================
+def test_inpaint_modes():
+   a = _holes((30, 40))
+   valid = ~np.isnan(a)
+   for method in ['frontier', 'nearest', 'pyramid', 'iterative']:
+      out = replace_nans.inpaint(a, method, 1, 'localmean', 50, 1e-6)
+      assert np.array_equal(out[valid], a[valid])
+      assert np.isfinite(out).all()
+      # filled values are weighted means of the valid values
+      assert out.min() >= a[valid].min() and out.max() <= a[valid].max()
+
+# =========================================================
+def test_inpaint_nearest():
+   a = _holes((20, 25), seed=1)
+   out = replace_nans.inpaint(a, 'nearest', max_iter=0)
+   vi, vj = np.nonzero(~np.isnan(a))
+   for i, j in zip(*np.nonzero(np.isnan(a))):
+      d = (vi-i)**2 + (vj-j)**2
+      assert out[i,j] in a[vi[d==d.min()], vj[d==d.min()]]
+
+# =========================================================
+def test_find_packets():
+   rng = np.random.RandomState(0)
+   pattern = np.array([192, 222, 171, 33, 128], np.uint8)
+   buf = rng.randint(0, 256, 5000).astype(np.uint8)
+   pos = np.sort(rng.choice(np.arange(0, 5000-5, 7), 40, replace=False))
+   for k in pos:
+      buf[k:k+5] = pattern
+   ref = [i for i in xrange(len(buf)-4) if (buf[i:i+5]==pattern).all()]
+   assert np.array_equal(pyread.find_packets(buf, pattern), ref)
+   assert len(pyread.find_packets(buf[:3], pattern)) == 0
+
+# =========================================================
+def test_echostats_merge():
+   rng = np.random.RandomState(0)
+   parts = [rng.rand(n)*300-20 for n in [1000, 1, 0, 2500]]
+   parts[0][::7] = np.nan
+   stats = humutils.EchoStats(0, 255, 64)
+   for k in parts:
+      stats.merge(humutils.EchoStats(0, 255, 64).push(k))
+   d = np.hstack(parts)
+   d = d[np.isfinite(d)]
+   assert stats.n == len(d)
+   assert np.allclose([stats.mean, stats.var, stats.min, stats.max], [d.mean(), d.var(), d.min(), d.max()])
+   assert np.array_equal(stats.hist, np.histogram(np.clip(d, 0, 255), stats.edges)[0])
+   # round trip through the dictionary stored in meta.mat
+   s = humutils.EchoStats.fromdict(stats.todict('port_la'), 'port_la')
+   assert s.n == stats.n and np.allclose(s.var, stats.var)
+   assert humutils.EchoStats.fromdict({}, 'port_la') is None
+
+# =========================================================
+def test_running_stats():
+   rng = np.random.RandomState(0)
+   d = rng.randn(1000)*3+1
+   s, (mn, sd) = stdev.combine([stdev.summary(d[:100]), stdev.summary(d[100:])])
+   assert np.allclose(s, stdev.summary(d))
+   assert np.allclose([mn, sd], [d.mean(), d.std(ddof=1)])
+   assert np.allclose(stdev.proc(d).getdata(), [d.mean(), d.std(ddof=1)])
+
+# =========================================================
+def test_range_geometry():
+   nchunk, nrows, ncols = 3, 40, 25
+   rng = np.random.RandomState(0)
+   pix_m = 0.1
+   dep_m = 1+rng.rand(nchunk*ncols)
+   bed = rng.randint(0, nrows+5, nchunk*ncols)
+   R = humutils.RangeGeometry(dep_m, pix_m, bed, (nchunk, nrows, ncols))
+   yvec = np.linspace(pix_m, nrows*pix_m, nrows)
+   for p in xrange(nchunk):
+      # as remove_water made the range matrix
+      d = dep_m[ncols*p:ncols*(p+1)]
+      Zbed = bed[ncols*p:ncols*(p+1)]
+      r = np.ones((nrows, ncols))
+      for k in xrange(ncols):
+         r[:,k] = d[k]/yvec
+         r[:,k] = np.r_[r[Zbed[k]:,k], np.zeros(nrows-len(r[Zbed[k]:,k]))]
+      assert np.allclose(R[p], r, rtol=1e-6)
+      assert np.allclose(R.gettile(p, slice(5, 30), slice(3, 20)), r[5:30, 3:20], rtol=1e-6)
+
+# =========================================================
+def test_im_resize():
+   rng = np.random.RandomState(0)
+   im = rng.rand(30, 50)
+   Ny, Nx = 75, 110
+   out = humutils.im_resize(im, Nx, Ny, 'bilinear', maxbytes=2**10)
+   # sample points spread from 0 to n, clamped at the edges
+   y = np.clip(np.linspace(0, 30, Ny), 0, 29)
+   x = np.clip(np.linspace(0, 50, Nx), 0, 49)
+   ref = map_coordinates(im, np.meshgrid(y, x, indexing='ij'), order=1)
+   assert np.allclose(out, ref, atol=1e-6)
+   # bicubic reproduces the samples at integer positions, and constants
+   out = humutils.im_resize(im, 101, 61, 'bicubic')
+   assert np.allclose(out[::2, ::2][:-1, :-1], im, atol=1e-6)
+   assert np.allclose(humutils.im_resize(np.ones((7, 9)), 20, 30), 1)
+
+# =========================================================
+def test_cwt_var2():
+   rng = np.random.RandomState(0)
+   win = 32
+   windows = np.cumsum(rng.randn(3, win, win), axis=2)
+   d = cwt.cwt_var2(windows, win/2, 4, win, 4)
+   assert d.shape == (2, 3)
+   for k in xrange(3):
+      for o, x in enumerate([windows[k], windows[k].T]):
+         ref = cwt.Cwt(np.asarray(x, np.float32), win/2, 4, win, 4).getvar()
+         assert np.allclose(d[o,k], ref, rtol=1e-5)
+   assert np.allclose(cwt.cwt_var(windows, win/2, 4, win, 4), d[0])
+
+# =========================================================
+def test_ppdrc_tiles():
+   # echogram-like texture: fine on the left, coarse on the right
+   rng = np.random.RandomState(0)
+   im = 120+40*gaussian_filter(rng.randn(700, 900), 1.0)/0.28
+   im[:, 450:] = 120+160*gaussian_filter(rng.randn(700, 450), 6.0)/0.2
+   ref = ppdrc.ppdrc_tile(im, 128, 2)
+   # windows of 256, so the image is split into tiles on both axes. This
+   # texture is rougher at the split wavelength than a corrected echogram
+   out = ppdrc.ppdrc_tiles(im, 128, 2, maxbytes=2**22)
+   assert out.shape == im.shape
+   assert np.abs(out-ref).max() <= 5e-3*(ref.max()-ref.min())
+   assert np.array_equal(ppdrc.ppdrc_tiles(im, 128, 2, maxbytes=2**22, numthreads=2), out)
+   # an image that fits in the budget is filtered whole
+   assert np.array_equal(ppdrc.ppdrc_tiles(im[:200, :200], 128, 2), ppdrc.ppdrc_tile(im[:200, :200], 128, 2))
+
+# =========================================================
+def test_kmeans():
+   rng = np.random.RandomState(0)
+   fp = np.hstack((rng.randn(4, 500)*0.1+1, rng.randn(4, 500)*0.1+3)).reshape((4, 20, 50))
+   fp[:, :2] = 0
+   fp[:, 5, :] = np.nan
+   x = humutils.kmeans_sample(fp, 2000)
+   assert len(x) == 2000 and np.isfinite(x).all() and (x != 0).all()
+   centres = humutils.fit_kmeans(x, 2)
+   assert np.allclose(centres, [1, 3], atol=0.05)
+   labels = humutils.predict_kmeans(fp, centres)
+   assert labels.dtype == np.uint8
+   assert (labels[fp==0] == 255).all() and (labels[np.isnan(fp)] == 255).all()
+   ok = np.isfinite(fp) & (fp != 0)
+   assert np.array_equal(labels[ok], (fp[ok] > 2).astype(np.uint8))
+   wc = humutils.decode_kmeans(labels, centres)
+   assert np.isnan(wc[~ok]).all() and np.array_equal(wc[ok], centres[labels[ok]])
+   # fewer values than clusters
+   assert np.array_equal(humutils.fit_kmeans([2.0, 1.0], 3), [1, 2, 2])
+   assert np.array_equal(humutils.fit_kmeans([], 3), [0, 0, 0])
+
+# =========================================================
+def test_window_stats():
+   rng = np.random.RandomState(0)
+   a = rng.randn(37, 41)
+   a[rng.rand(37, 41) < 0.2] = np.nan
+   ws, ss = (8, 6), (3, 4)
+   n, m, v = humutils.window_stats(a, ws, ss, maxbytes=2**12)
+   w = humutils.sliding_window(a, ws, ss, flatten=False)
+   assert n.shape == w.shape[:2]
+   for i in xrange(n.shape[0]):
+      for j in xrange(n.shape[1]):
+         x = w[i,j][np.isfinite(w[i,j])]
+         assert n[i,j] == len(x)
+         assert np.allclose([m[i,j], v[i,j]], [x.mean(), x.var()])
+   # centred windows, NaN beyond the edges
+   n, m, v = humutils.local_stats(a, (5, 3), maxbytes=2**12)
+   b = np.pad(a, ((2, 2), (1, 1)), mode='constant', constant_values=np.nan)
+   for i in xrange(a.shape[0]):
+      for j in xrange(a.shape[1]):
+         x = b[i:i+5, j:j+3]
+         x = x[np.isfinite(x)]
+         assert n[i,j] == len(x)
+         if len(x):
+            assert np.allclose([m[i,j], v[i,j]], [x.mean(), x.var()])
+
+# =========================================================
+def dotest():
+   '''
+   run every test_ function of this module
+   '''
+   names = sorted(k for k in globals() if k.startswith('test_'))
+   for k in names:
+      globals()[k]()
+      print '%s ok' % k
+   print 'all %d tests passed' % len(names)
+
+if __name__ == '__main__':
+   dotest()
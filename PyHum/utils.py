@@ -24,10 +24,12 @@ from numpy.lib.stride_tricks import as_strided as ast
 from numpy import array, product, isnan, min, max, convolve, isnan, ones, mean, std, argmax, where, interp, shape, zeros, hstack, vstack, argmin, squeeze, choose, linspace, r_, cumsum, histogram, any, seterr
 
 from numpy import nan as npnan
+from numpy import arange, asarray, float32, float64, int64, inf, isfinite, clip, floor, empty, sort, searchsorted, flatnonzero, resize
+from numpy.random import RandomState
 from numpy.matlib import repmat
 
 from sklearn.cluster import MiniBatchKMeans
-from scipy.interpolate import RectBivariateSpline
+from collections import OrderedDict
 import string, random
 
 # suppress divide and invalid warnings
@@ -43,10 +45,25 @@ __all__ = [
     'nan_helper',
     'norm_shape',
     'sliding_window',
+    'window_grid',
+    'window_batch',
+    'window_bands',
+    'sat_moments',
+    'window_stats',
+    'local_stats',
+    'window_valid',
+    'window_microscale',
     'dpboundary',
     'cut_kmeans',
+    'kmeans_sample',
+    'fit_kmeans',
+    'predict_kmeans',
+    'decode_kmeans',
+    'interp_weights',
     'im_resize',
     'histeq',
+    'RangeGeometry',
+    'EchoStats',
     ]
 
 #################################################
@@ -84,12 +101,18 @@ def rm_spikes(dat,numstds):
    return dat
 
 # =========================================================
-def rescale(dat,mn,mx):
+def rescale(dat,mn,mx,stats=None):
    """
    rescales an input dat between mn and mx
+   if stats (an EchoStats) is given, the global min and max it holds are
+   used instead of those of dat, so chunks are scaled consistently
    """
-   m = min(dat.flatten())
-   M = max(dat.flatten())
+   if stats is not None:
+      m = stats.min
+      M = stats.max
+   else:
+      m = min(dat.flatten())
+      M = max(dat.flatten())
    return (mx-mn)*(dat-m)/(M-m)+mn
 
 # =========================================================
@@ -178,6 +201,170 @@ def sliding_window(a,ws,ss = None,flatten = True):
     
    return a.reshape(dim), newshape
 
+# =========================================================
+def window_grid(shap,ws,ss = None):
+   '''
+   number of sliding windows of size ws, stepped by ss, along each
+   dimension of an array of shape shap (as sliding_window)
+   '''
+   if None is ss:
+      ss = ws
+   return norm_shape((array(shap) - array(norm_shape(ws))) // array(norm_shape(ss)) + 1)
+
+# =========================================================
+def window_batch(a,ws,ss,k):
+   '''
+   windows k (a sequence of window numbers, row-major as in the flat
+   list returned by sliding_window) of 2D array a, as a (len(k), ws[0], 
+   ws[1]) array. Only these windows are copied, out of a zero-copy 
+   strided view of a, so a can be a (shared) memory-mapped file
+   '''
+   v = sliding_window(a,ws,ss,flatten=False)
+   k = asarray(k,'int')
+   return v[k // v.shape[1], k % v.shape[1]]
+
+# =========================================================
+def window_bands(shap,ws,ss = None,maxbytes=2**24):
+   '''
+   bands of rows of the grid of window_grid of an array of shape shap,
+   such that the summed-area tables of the array rows a band covers take
+   about maxbytes. Yields (k0, k1, r0, r1): windows in grid rows k0 to k1
+   cover array rows r0 to r1
+   '''
+   if None is ss:
+      ss = ws
+   ws = norm_shape(ws)
+   ss = norm_shape(ss)
+   ny = window_grid(shap,ws,ss)[0]
+   m = int((maxbytes//(32*(shap[1]+1)) - ws[0])//ss[0] + 1)
+   if m<1:
+      m = 1
+   for k0 in xrange(0,ny,m):
+      k1 = k0+m if k0+m<ny else ny
+      yield k0, k1, k0*ss[0], (k1-1)*ss[0]+ws[0]
+
+# =========================================================
+def sat_moments(x,i0,i1,j0,j1):
+   '''
+   number, mean and variance of the finite values of 2D array x in each
+   window x[i0:i1, j0:j1] (for every pair of rows i0, i1 and columns j0,
+   j1), from summed-area tables, so in constant time per window. Mean and
+   variance are NaN where there are no finite values
+   '''
+   ok = isfinite(x)
+   c = x[ok].mean() if ok.any() else 0.0 # offset, for precision
+   x = where(ok, x-c, 0)
+   S = []
+   for y in [ok, x, x*x]:
+      sat = zeros((x.shape[0]+1, x.shape[1]+1))
+      sat[1:,1:] = cumsum(cumsum(y,axis=0),axis=1)
+      S.append(sat[i1][:,j1] - sat[i0][:,j1] - sat[i1][:,j0] + sat[i0][:,j0])
+   n, s, s2 = S
+   m = s/n
+   v = s2/n - m*m
+   v[v<0] = 0
+   return n, m+c, v
+
+# =========================================================
+def window_stats(a,ws,ss = None,maxbytes=2**24):
+   '''
+   number, mean and variance of the finite values in each sliding window
+   of 2D array a (e.g. memory-mapped), on the grid of window_grid. See 
+   sat_moments: the cost per window does not depend on ws. a is read a 
+   band of rows at a time (see window_bands)
+   '''
+   if None is ss:
+      ss = ws
+   ws = norm_shape(ws)
+   ss = norm_shape(ss)
+   ny, nx = window_grid(a.shape,ws,ss)
+   j0 = arange(nx)*ss[1]
+   j1 = j0 + ws[1]
+   out = [empty((ny,nx)) for k in xrange(3)]
+   for k0, k1, r0, r1 in window_bands(a.shape,ws,ss,maxbytes):
+      i0 = arange(k1-k0)*ss[0]
+      stats = sat_moments(asarray(a[r0:r1],float64),i0,i0+ws[0],j0,j1)
+      for k in xrange(3):
+         out[k][k0:k1] = stats[k]
+   return out
+
+# =========================================================
+def local_stats(a,ws,out=None,maxbytes=2**24):
+   '''
+   number, mean and variance of the finite values of 2D array a (e.g. 
+   memory-mapped) in the window of size ws centred on each element (as in
+   scipy.ndimage filters; elements beyond the edges count as NaN). See 
+   sat_moments: the cost per element does not depend on ws. a is read, and
+   the results written into out (a list of 3 arrays the shape of a, e.g.
+   memory-mapped, or new float64 arrays if not given), a band of rows at
+   a time
+   '''
+   ws = norm_shape(ws)
+   nr, nc = a.shape
+   if out is None:
+      out = [empty((nr,nc)) for k in xrange(3)]
+   h0, h1 = ws[0]//2, ws[1]//2
+   step = int(maxbytes//(32*(nc+ws[1])) - ws[0] + 1)
+   if step<1:
+      step = 1
+   j0 = arange(nc)
+   for r0 in xrange(0,nr,step):
+      r1 = r0+step if r0+step<nr else nr
+      # rows r0-h0 to r1-h0+ws[0]-1 of a, NaN beyond the edges
+      band = npnan*ones((r1-r0+ws[0]-1, nc+ws[1]-1))
+      lo = r0-h0
+      hi = r1-h0+ws[0]-1
+      band[(lo if lo>0 else 0)-lo:(hi if hi<nr else nr)-lo, h1:h1+nc] = a[(lo if lo>0 else 0):(hi if hi<nr else nr)]
+      i0 = arange(r1-r0)
+      stats = sat_moments(band,i0,i0+ws[0],j0,j0+ws[1])
+      for k in xrange(3):
+         out[k][r0:r1] = stats[k]
+   return out
+
+# =========================================================
+def window_valid(a,ws,ss = None):
+   '''
+   fraction of finite values in each sliding window of 2D array a, on the
+   grid of window_grid (see window_stats)
+   '''
+   ws = norm_shape(ws)
+   return window_stats(a,ws,ss)[0]/float(ws[0]*ws[1])
+
+# =========================================================
+def window_microscale(a,ws,ss = None,maxbytes=2**24):
+   '''
+   fast texture lengthscale of each sliding window of 2D array a, on the
+   grid of window_grid: the sum over both axes of the Taylor microscale 
+   sqrt(var(a)/var(da)), where da are the differences between neighbouring
+   pixels along the axis. Local variances come from summed-area tables 
+   of the valid (finite) values (see sat_moments), so the cost does not 
+   depend on ws, a band of rows at a time (see window_bands). NaN where a
+   window has no variation
+   '''
+   if None is ss:
+      ss = ws
+   ws = norm_shape(ws)
+   ss = norm_shape(ss)
+   ny, nx = window_grid(a.shape,ws,ss)
+   j0 = arange(nx)*ss[1]
+   j1 = j0 + ws[1]
+   L = zeros((ny,nx))
+   for k0, k1, r0, r1 in window_bands(a.shape,ws,ss,maxbytes):
+      i0 = arange(k1-k0)*ss[0]
+      i1 = i0 + ws[0]
+      # with the next row, for the differences along the last one
+      band = asarray(a[r0:r1+1],float64)
+      v = sat_moments(band,i0,i1,j0,j1)[2]
+      for axis in [0,1]:
+         d = npnan*ones(band.shape)
+         if axis==0:
+            d[:-1] = band[1:] - band[:-1]
+         else:
+            d[:,:-1] = band[:,1:] - band[:,:-1]
+         L[k0:k1] += (v/sat_moments(d,i0,i1,j0,j1)[2])**0.5
+   L[~isfinite(L) | (L==0)] = npnan
+   return L
+   
 # =========================================================
 def dpboundary(imu):
    '''
@@ -230,22 +417,127 @@ def cut_kmeans(w,numclusters):
    return wc, values
 
 # =========================================================
-def im_resize(im,Nx,Ny):
+def kmeans_sample(fp,nsample=100000,seed=0):
    '''
-   resize array by bivariate spline interpolation
+   stratified random sample of about nsample of the valid (finite and 
+   non-zero) values of fp, an array of chunks (e.g. memory-mapped): the 
+   same number is drawn from each chunk, one chunk at a time
    '''
-   ny, nx = shape(im)
-   xx = linspace(0,nx,Nx)
-   yy = linspace(0,ny,Ny)
-   newKernel = RectBivariateSpline(r_[:ny],r_[:nx],im) 
-   return newKernel(yy,xx)
+   rng = RandomState(seed)
+   m = int(nsample//len(fp)) or 1
+   sample = []
+   for p in xrange(len(fp)):
+      w = asarray(fp[p]).ravel()
+      k = flatnonzero(isfinite(w) & (w!=0))
+      if len(k)>m:
+         k = sort(rng.choice(k,m,replace=False))
+      sample.append(w[k])
+   return hstack(sample)
 
 # =========================================================
-def histeq(im,nbr_bins=256):
+def fit_kmeans(x,numclusters,seed=0):
+   '''
+   k-means cluster centres of the values x, in ascending order. With fewer
+   values than clusters (e.g. no texture at all at this window size), the
+   values themselves are repeated (zeros if there are none)
+   '''
+   x = asarray(x,float64).ravel()
+   if len(x) < numclusters:
+      if not len(x):
+         return zeros(numclusters)
+      return sort(resize(x,numclusters))
+   k_means = MiniBatchKMeans(numclusters,random_state=seed)
+   k_means.fit(x.reshape((-1, 1)))
+   return sort(k_means.cluster_centers_.ravel())
 
+# =========================================================
+def predict_kmeans(w,centres):
+   '''
+   label (index of the nearest of the ascending centres) of each value of 
+   w, as uint8, or 255 where w is not valid (not finite or zero), as in
+   kmeans_sample. See decode_kmeans
+   '''
+   if len(centres)>255:
+      raise ValueError('at most 255 classes can be labelled')
+   w = asarray(w)
+   edges = (asarray(centres[1:])+asarray(centres[:-1]))/2
+   labels = searchsorted(edges,w).astype('uint8')
+   labels[~isfinite(w) | (w==0)] = 255
+   return labels
+
+# =========================================================
+def decode_kmeans(labels,centres):
+   '''
+   centre of the class of each label of predict_kmeans, NaN for 255
+   '''
+   wc = hstack((asarray(centres,float64).ravel(), npnan))
+   labels = asarray(labels).astype('int')
+   labels[labels>=len(wc)-1] = len(wc)-1
+   return wc[labels]
+
+# =========================================================
+def interp_weights(n,N,method='bicubic'):
+   '''
+   1D interpolation of n samples at N points spread from 0 to n (as in
+   im_resize): the indices of the samples used for each point and their
+   weights, as (N, 2) arrays (bilinear) or (N, 4) arrays (bicubic, Keys
+   cubic convolution with a=-0.5). Indices beyond the edges are clamped
+   '''
+   x = linspace(0,n,N)
+   i = floor(x)
+   t = (x-i)[:,None]
+   if method=='bilinear':
+      k = i[:,None] + r_[0,1]
+      w = hstack((1-t, t))
+   elif method=='bicubic':
+      k = i[:,None] + r_[-1,0,1,2]
+      w = hstack(( ((-0.5*t+1)*t-0.5)*t, (1.5*t-2.5)*t*t+1, ((-1.5*t+2)*t+0.5)*t, (0.5*t-0.5)*t*t ))
+   else:
+      raise ValueError("method should be 'bilinear' or 'bicubic'")
+   return clip(k,0,n-1).astype('int'), w
+
+# =========================================================
+def im_resize(im,Nx,Ny,method='bicubic',out=None,maxbytes=2**23):
+   '''
+   resize array to Ny rows by Nx columns by separable bilinear or bicubic 
+   interpolation (see interp_weights). The columns are interpolated first,
+   on the rows of im, then the rows, a tile of about maxbytes at a time,
+   into out (e.g. a memory-mapped array) which is returned. If out is not
+   given, a float32 array is made
+   '''
+   im = asarray(im,float64)
+   ny, nx = shape(im)
+   kx, wx = interp_weights(nx,Nx,method)
+   ky, wy = interp_weights(ny,Ny,method)
+
+   cols = zeros((ny,Nx))
+   for j in xrange(kx.shape[1]):
+      cols += im[:,kx[:,j]]*wx[:,j]
+
+   if out is None:
+      out = empty((Ny,Nx),float32)
+   step = int(maxbytes//(8*Nx)) or 1
+   for i in xrange(0,Ny,step):
+      k = ky[i:i+step]
+      tile = zeros((len(k),Nx))
+      for j in xrange(ky.shape[1]):
+         tile += cols[k[:,j]]*wy[i:i+step,j,None]
+      out[i:i+step] = tile
+   return out
+
+# =========================================================
+def histeq(im,nbr_bins=256,stats=None):
+   '''
+   histogram equalisation of im. If stats (an EchoStats) is given its
+   global histogram is used rather than that of im, so every chunk
+   is mapped through the same transfer function
+   '''
    im[isnan(im)] = 0
    #get image histogram
-   imhist,bins = histogram(im.flatten(),nbr_bins,normed=True)
+   if stats is not None:
+      imhist, bins = stats.hist, stats.edges
+   else:
+      imhist,bins = histogram(im.flatten(),nbr_bins,normed=True)
    cdf = imhist.cumsum() #cumulative distribution function
    cdf = 255 * cdf / cdf[-1] #normalize
 
@@ -253,4 +545,181 @@ def histeq(im,nbr_bins=256):
    im2 = interp(im.flatten(),bins[:-1],cdf)
 
    return im2.reshape(im.shape), cdf
-    
+
+# =========================================================
+class RangeGeometry(object):
+   '''
+   range geometry (depth / slant range) of a chunked sidescan echogram,
+   shifted by the bed pick exactly as the scans are in correct_chunk.
+   Computed on demand from dep_m, pix_m and bed; the most recently used
+   tiles are kept in an LRU cache of up to maxtiles entries.
+
+   Indexing with a chunk number returns the (read-only, float32) range
+   matrix for that chunk, so this can stand in for the old
+   _data_range.dat memory-mapped file
+   '''
+   def __init__(self, dep_m, pix_m, bed, shape, maxtiles=16):
+      self.dep_m = asarray(dep_m, float64).flatten()
+      self.bed = asarray(bed, 'int').flatten()
+      self.pix_m = float(asarray(pix_m).flatten()[0])
+      self.shape = tuple(int(k) for k in shape)
+      self.maxtiles = maxtiles
+      self.tiles = OrderedDict()
+      extent = self.shape[1]
+      self.yvec = linspace(self.pix_m,extent*self.pix_m,extent)
+
+   def __len__(self):
+      return self.shape[0]
+
+   def __getstate__(self):
+      # the tile cache is not sent to worker processes
+      state = self.__dict__.copy()
+      state['tiles'] = OrderedDict()
+      return state
+
+   def __getitem__(self, p):
+      return self.gettile(p)
+
+   def gettile(self, p, rows=slice(None), cols=slice(None)):
+      '''
+      return rows, cols of the range matrix for chunk p
+      '''
+      p = int(p) % self.shape[0]
+      r0, r1, _ = rows.indices(self.shape[1])
+      c0, c1, _ = cols.indices(self.shape[2])
+      key = (p, r0, r1, c0, c1)
+      try:
+         tile = self.tiles.pop(key)
+      except KeyError:
+         tile = self._calc(p, r0, r1, c0, c1)
+         if len(self.tiles) >= self.maxtiles:
+            self.tiles.popitem(last=False)
+      self.tiles[key] = tile
+      return tile
+
+   def _calc(self, p, r0, r1, c0, c1):
+      '''
+      r[i,k] = d[k]/yvec[i+Zbed[k]], zero beyond the end of the scan and one
+      where there is no depth or bed for the ping
+      '''
+      nrows = self.shape[1]
+      ncols = self.shape[2]
+      d = self.dep_m[ncols*p:ncols*(p+1)][c0:c1]
+      Zbed = self.bed[ncols*p:ncols*(p+1)][c0:c1]
+
+      r = ones((r1-r0, c1-c0), float64)
+      nb = len(Zbed)
+      nd = len(d[:nb])
+      if nb:
+         ind = arange(r0,r1)[:,None] + Zbed[None,:]
+         valid = (ind < nrows) & (ind >= 0)
+         r[:,:nb] = valid
+         tmp = d[None,:nd]/self.yvec[ind[:,:nd].clip(0,nrows-1)]
+         r[:,:nd][valid[:,:nd]] = tmp[valid[:,:nd]]
+      r = r.astype(float32)
+      r.flags.writeable = False
+      return r
+
+
+# =========================================================
+class EchoStats(object):
+   '''
+   streaming, mergeable statistics of an echogram: count, min, max,
+   mean, sum of squared deviations (M2) and a histogram on fixed bins
+   between mn and mx (values outside are counted in the end bins).
+   NaNs are ignored.
+
+   Chunks are added with push(); statistics of separately processed
+   chunks (e.g. in worker processes) are combined with merge(), using
+   the pairwise update of Chan et al. (1979) for mean and M2
+   '''
+   def __init__(self, mn=0, mx=255, nbins=256):
+      self.edges = linspace(mn, mx, nbins+1)
+      self.hist = zeros(nbins, int64)
+      self.n = 0
+      self.mean = 0.0
+      self.M2 = 0.0
+      self.min = inf
+      self.max = -inf
+
+   def push(self, dat):
+      '''
+      add the finite values of array dat
+      '''
+      d = asarray(dat, float64).ravel()
+      d = d[isfinite(d)]
+      if not len(d):
+         return self
+      other = EchoStats.__new__(EchoStats)
+      other.edges = self.edges
+      other.hist = histogram(clip(d, self.edges[0], self.edges[-1]), self.edges)[0]
+      other.n = len(d)
+      other.mean = d.mean()
+      other.M2 = ((d-other.mean)**2).sum()
+      other.min = d.min()
+      other.max = d.max()
+      return self.merge(other)
+
+   def merge(self, other):
+      '''
+      merge the statistics held in other (with the same bins) into these
+      '''
+      if not other.n:
+         return self
+      n = self.n + other.n
+      delta = other.mean - self.mean
+      self.mean = self.mean + delta*other.n/float(n)
+      self.M2 = self.M2 + other.M2 + delta**2*self.n*other.n/float(n)
+      self.n = n
+      self.hist = self.hist + other.hist
+      if other.min < self.min:
+         self.min = other.min
+      if other.max > self.max:
+         self.max = other.max
+      return self
+
+   @property
+   def var(self):
+      if self.n:
+         return self.M2/self.n
+      return npnan
+
+   @property
+   def std(self):
+      return self.var**0.5
+
+   def percentile(self, q):
+      '''
+      q-th percentile (0-100), interpolated from the histogram
+      '''
+      cdf = r_[0, cumsum(self.hist)].astype(float64)
+      if not cdf[-1]:
+         return npnan
+      return interp(q/100.0*cdf[-1], cdf, self.edges)
+
+   def todict(self, prefix):
+      '''
+      flat dictionary of the statistics, with keys prefixed by prefix,
+      suitable for storing in meta.mat
+      '''
+      return {prefix+'_n': self.n, prefix+'_min': self.min, prefix+'_max': self.max,
+              prefix+'_mean': self.mean, prefix+'_M2': self.M2,
+              prefix+'_hist': self.hist, prefix+'_edges': self.edges}
+
+   @classmethod
+   def fromdict(cls, meta, prefix):
+      '''
+      rebuild statistics stored by todict (e.g. loaded from meta.mat).
+      Returns None if they are not there
+      '''
+      if prefix+'_n' not in meta:
+         return None
+      self = cls.__new__(cls)
+      self.edges = asarray(meta[prefix+'_edges'], float64).flatten()
+      self.hist = asarray(meta[prefix+'_hist'], int64).flatten()
+      self.n = int(squeeze(meta[prefix+'_n']))
+      self.min = float(squeeze(meta[prefix+'_min']))
+      self.max = float(squeeze(meta[prefix+'_max']))
+      self.mean = float(squeeze(meta[prefix+'_mean']))
+      self.M2 = float(squeeze(meta[prefix+'_M2']))
+      return self
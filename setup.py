@@ -143,7 +143,9 @@ if USE_CYTHON:
         include_dirs=[np.get_include()]),
         Extension("PyHum.stdev", [ "PyHum/_stdev.pyx" ],
         include_dirs=[np.get_include()]),
-        Extension('_RunningStats',sources=['PyHum/RunningStats_wrap.cxx', 'PyHum/RunningStats.cpp']),
+        Extension("PyHum.median", [ "PyHum/_median.pyx" ],
+        include_dirs=[np.get_include()]),
+        Extension('PyHum._RunningStats',sources=['PyHum/RunningStats_wrap.cxx', 'PyHum/RunningStats.cpp']),
     ]
     cmdclass.update({ 'build_ext': build_ext })
 else:
@@ -160,7 +162,9 @@ else:
         include_dirs=[np.get_include()]),
         Extension("PyHum.stdev", [ "PyHum/_stdev.c" ],
         include_dirs=[np.get_include()]),
-        Extension('_RunningStats',sources=['PyHum/RunningStats_wrap.cxx', 'PyHum/RunningStats.cpp']),
+        Extension("PyHum.median", [ "PyHum/_median.c" ],
+        include_dirs=[np.get_include()]),
+        Extension('PyHum._RunningStats',sources=['PyHum/RunningStats_wrap.cxx', 'PyHum/RunningStats.cpp']),
     ]
 install_requires = [
     'numpy','scipy','Pillow','matplotlib', 'cython', 'pyproj', 'scikit-image', 'simplekml', 'joblib', 'basemap', 'scikit-learn'